@@ -1,8 +1,9 @@
-import os
-import random
-from flask import Blueprint, jsonify, send_file
+from io import BytesIO
+from flask import Blueprint
 from openpyxl import Workbook
 from connections import db
+from jobs.runner import JobResult
+from jobs.views import enqueue_job
 
 admin = Blueprint("admin", __name__)
 
@@ -16,8 +17,7 @@ def product_to_row(prod):
     ]
 
 
-@admin.get("/backup/prods")
-def backup_products():
+def build_products_backup():
     workbook = Workbook()
     sheet = workbook.active
 
@@ -25,21 +25,19 @@ def backup_products():
     for row in data:
         sheet.append(product_to_row(row))
 
-    backup_id = random.randrange(start=1)
-
-    if not os.path.exists("/tmp/fishnet/backup"):
-        os.makedirs("/tmp/fishnet/backup")
+    buffer = BytesIO()
+    workbook.save(buffer)
 
-    temp_path = f"/tmp/fishnet/backup/{backup_id}.xlsx"
+    return JobResult(
+        buffer.getvalue(),
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        download_name="backup_prods.xlsx",
+    )
 
-    workbook.save(temp_path)
 
-    try:
-        return send_file(temp_path)
-    except Exception as e:
-        return jsonify({"message": e.args}), 400
-    # finally:
-    #     os.remove(temp_path)
+@admin.get("/backup/prods")
+def backup_products():
+    return enqueue_job("admin.backup_prods", build_products_backup)
 
 
 @admin.get("/backup/sales")
@@ -0,0 +1,95 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from os import environ
+from typing import Any, Callable
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(environ.get("BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(environ.get("HASH_WORKERS", 2))
+HASH_QUEUE_LIMIT = int(environ.get("HASH_QUEUE_LIMIT", 2 * HASH_WORKERS))
+HASH_TIMEOUT = float(environ.get("HASH_TIMEOUT", 5))
+
+# O bcrypt roda em processos separados, num único pool por worker do gunicorn
+# (threads gthread, ver render.yaml): um pico de logins ocupa no máximo
+# HASH_WORKERS núcleos e HASH_QUEUE_LIMIT threads. Acima disso o pedido é
+# recusado na hora com 503, e as outras threads continuam servindo a API.
+# HASH_QUEUE_LIMIT deve ser menor que o número de threads por worker.
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+
+
+class HashingBusyError(Exception):
+    pass
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=HASH_WORKERS, mp_context=get_context("spawn")
+            )
+        return _executor
+
+
+def _discard(pool: ProcessPoolExecutor):
+    # Um processo do pool morreu: o próximo pedido cria um pool novo
+    global _executor
+    with _executor_lock:
+        if _executor is pool:
+            _executor = None
+
+
+def _submit(fn: Callable[..., Any], *args: Any) -> Any:
+    if not _slots.acquire(blocking=False):
+        raise HashingBusyError("Too many password checks in progress, try again later")
+
+    pool = _pool()
+    try:
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        _slots.release()
+        _discard(pool)
+        raise HashingBusyError("Password hashing unavailable, try again later")
+
+    # A vaga só volta quando o processo termina o hash, mesmo que o pedido
+    # tenha desistido antes: a contagem reflete o que o pool está fazendo
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise HashingBusyError("Password hashing timed out, try again later")
+    except BrokenProcessPool:
+        _discard(pool)
+        raise HashingBusyError("Password hashing unavailable, try again later")
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_password(password: str) -> bytes:
+    """Gera o hash com BCRYPT_ROUNDS. Lança HashingBusyError após HASH_TIMEOUT."""
+    return _submit(_hash, password.encode(), BCRYPT_ROUNDS)
+
+
+def check_password(password: str, hashed: bytes) -> bool:
+    """Confere a senha com o hash. Lança HashingBusyError após HASH_TIMEOUT."""
+    return _submit(_check, password.encode(), hashed)
+
+
+def needs_rehash(hashed: bytes) -> bool:
+    """Verdadeiro se o hash foi gerado com um custo diferente de BCRYPT_ROUNDS."""
+    try:
+        return int(hashed.split(b"$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
@@ -1,39 +1,176 @@
+from dataclasses import dataclass
 from functools import wraps
+from os import environ
+from typing import Any, Optional
 
-import bcrypt
 import jwt
 from bson import ObjectId
-from flask import Blueprint, current_app, jsonify, request
-
+from bson.errors import InvalidId
+from flask import Blueprint, current_app, g, jsonify, request
+
+from auth.passwords import (
+    HashingBusyError,
+    check_password,
+    hash_password,
+    needs_rehash,
+)
+from cache import InvalidationChannel, TTLCache
 from connections import db
+from ratelimit import TokenBucket, retry_after
 
 auth = Blueprint("auth", __name__)
 collection = db["users"]
 
+# Senha e dados de cartão nunca entram no cache (nomes como em crud/models.py)
+USER_PROJECTION = {
+    "password": 0,
+    "serial_cc": 0,
+    "expiration_cc": 0,
+    "backserial_cc": 0,
+}
+
+# Uma alteração ou remoção de usuário descarta o cache de todos os workers,
+# no máximo USER_CACHE_SYNC_INTERVAL segundos depois
+user_cache = TTLCache(
+    maxsize=int(environ.get("USER_CACHE_SIZE", 4096)),
+    ttl=float(environ.get("USER_CACHE_TTL", 30)),
+    channel=InvalidationChannel(
+        db["cache_versions"],
+        "users",
+        float(environ.get("USER_CACHE_SYNC_INTERVAL", 2)),
+    ),
+)
+
+# Tentativas permitidas por janela nas rotas que rodam bcrypt
+AUTH_LIMIT_WINDOW = float(environ.get("AUTH_LIMIT_WINDOW", 60))
+AUTH_LIMIT_IP = int(environ.get("AUTH_LIMIT_IP", 20))
+AUTH_LIMIT_EMAIL = int(environ.get("AUTH_LIMIT_EMAIL", 5))
+LIMITED_ENDPOINTS = {"auth.login", "auth.register", "auth.change_password"}
+
+# Com AUTH_LIMIT_BACKEND=mongo os limites valem para todos os workers juntos
+rate_limits = db["rate_limits"]
+_backend = rate_limits if environ.get("AUTH_LIMIT_BACKEND") == "mongo" else None
+ip_limiter = TokenBucket(AUTH_LIMIT_IP / AUTH_LIMIT_WINDOW, AUTH_LIMIT_IP, _backend)
+email_limiter = TokenBucket(
+    AUTH_LIMIT_EMAIL / AUTH_LIMIT_WINDOW, AUTH_LIMIT_EMAIL, _backend
+)
+
+
+class AuthError(Exception):
+    def __init__(self, message: str, code: int, payload: Optional[dict] = None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.payload = payload
+
+    def response(self):
+        body = {"message": self.message}
+        if self.payload is not None:
+            body["res"] = self.payload
+        return jsonify(body), self.code
+
+
+@dataclass
+class Identity:
+    """Usuário autenticado na requisição atual."""
+
+    id: ObjectId
+    payload: dict[str, Any]
+    user: dict[str, Any]
+
+
+def get_user(user_id: ObjectId) -> Optional[dict[str, Any]]:
+    return user_cache.get_or_set(
+        user_id, lambda: collection.find_one({"_id": user_id}, USER_PROJECTION)
+    )
 
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get("Authorization")
 
-        if auth_header is None:
-            return jsonify({"message": "Token não fornecido."}), 400
+def invalidate_user(user_id: ObjectId | str):
+    user_cache.pop(ObjectId(user_id))
+    user_cache.channel.publish()
+
 
+def _authenticate() -> Identity:
+    auth_header = request.headers.get("Authorization")
+    if auth_header is None:
+        raise AuthError("Token não fornecido.", 400)
+
+    try:
+        payload = jwt.decode(
+            auth_header.encode(),
+            current_app.config["SECRET_KEY"],
+            algorithms=["HS256"],
+        )
+        user_id = ObjectId(payload["sub"])
+    except (jwt.InvalidTokenError, InvalidId, KeyError, TypeError):
+        raise AuthError("Token inválido.", 400)
+
+    user = get_user(user_id)
+    if user is None:
+        raise AuthError("Usuário não encontrado.", 404, payload)
+
+    return Identity(user_id, payload, user)
+
+
+def current_identity() -> Identity:
+    """Verifica o token uma única vez por requisição e guarda o resultado em `g`.
+
+    Lança AuthError se o token for ausente ou inválido, ou se o usuário não existir.
+    """
+    if "auth_error" in g:
+        raise g.auth_error
+    if "identity" not in g:
         try:
-            payload = jwt.decode(
-                auth_header.encode(),
-                current_app.config["SECRET_KEY"],
-                algorithms=["HS256"],
+            g.identity = _authenticate()
+        except AuthError as e:
+            g.auth_error = e
+            raise
+    return g.identity
+
+
+@auth.before_request
+def limit_rate():
+    """Limita login, cadastro e troca de senha por IP e e-mail, antes do bcrypt."""
+    if request.endpoint not in LIMITED_ENDPOINTS:
+        return None
+
+    if request.endpoint == "auth.change_password":
+        try:
+            email = current_identity().payload.get("email")
+        except AuthError:
+            email = None  # o login_required responde
+    else:
+        email = (request.get_json(silent=True) or {}).get("email")
+
+    checks = [(ip_limiter, f"ip:{request.remote_addr}")]
+    if isinstance(email, str):
+        checks.append((email_limiter, f"email:{email.strip().lower()}"))
+
+    for limiter, key in checks:
+        if wait := limiter.consume(key):
+            return (
+                jsonify({"message": "Muitas tentativas, tente novamente mais tarde."}),
+                429,
+                {"Retry-After": retry_after(wait)},
             )
-        except Exception as e:
-            print(e.args)
-            return jsonify({"message": "Token inválido."}), 400
 
-        user = collection.find_one({"_id": ObjectId(payload["sub"])})
-        if user is None:
-            return jsonify({"message": "Usuário não encontrado.", "res": payload}), 404
+    return None
+
 
-        return f(*args, payload, **kwargs)
+@auth.errorhandler(HashingBusyError)
+def hashing_busy(e):
+    return jsonify({"message": str(e)}), 503, {"Retry-After": "1"}
+
+
+def login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            identity = current_identity()
+        except AuthError as e:
+            return e.response()
+
+        return f(*args, identity.payload, **kwargs)
 
     return decorated_function
 
@@ -53,14 +190,12 @@ def register():
     if collection.find_one({"email": post_data.get("email")}) is not None:
         return jsonify({"message": "Usuário já cadastrado."}), 409
 
-    hashed_password = bcrypt.hashpw(
-        post_data.get("password").encode(), bcrypt.gensalt()
-    )
-
     role = post_data.get("role")
     if role not in ["admin", "cpf", "cnpj", "staff"]:
         return jsonify({"message": "Papel inválido."}), 400
 
+    hashed_password = hash_password(post_data.get("password"))
+
     user = {
         "name": post_data.get("name"),
         "email": post_data.get("email"),
@@ -107,7 +242,18 @@ def login():
     if user is None:
         return jsonify({"message": "Login inválido."}), 404
 
-    if bcrypt.checkpw(bytes(post_data.get("password"), "utf-8"), user["password"]):
+    if check_password(post_data.get("password"), user["password"]):
+        if needs_rehash(user["password"]):
+            # Atualiza hashes antigos para o custo atual; se a fila estiver
+            # cheia, fica para o próximo login
+            try:
+                collection.update_one(
+                    {"_id": user["_id"], "password": user["password"]},
+                    {"$set": {"password": hash_password(post_data.get("password"))}},
+                )
+            except HashingBusyError:
+                pass
+
         payload = {
             "sub": str(user["_id"]),
             "email": user["email"],
@@ -122,21 +268,10 @@ def login():
 
 @auth.get("/check")
 def me():
-    auth_header = request.headers.get("Authorization")
-    if auth_header is None:
-        return jsonify({"message": "Token não fornecido."}), 400
-
     try:
-        payload = jwt.decode(
-            auth_header.encode(), current_app.config["SECRET_KEY"], algorithms=["HS256"]
-        )
-    except Exception as e:
-        print(e.args)
-        return jsonify({"message": "Token inválido."}), 400
-
-    user = collection.find_one({"_id": ObjectId(payload["sub"])})
-    if user is None:
-        return jsonify({"message": "Usuário não encontrado.", "res": payload}), 404
+        user = current_identity().user
+    except AuthError as e:
+        return e.response()
 
     return (
         jsonify(
@@ -157,7 +292,7 @@ def me():
 @login_required
 def change_password(payload):
     post_data = request.get_json()
-    user = collection.find_one({"_id": ObjectId(payload["sub"])})
+    user = collection.find_one({"_id": ObjectId(payload["sub"])}, {"password": 1})
 
     if user is None:
         return jsonify({"message": "Usuário não encontrado."}), 404
@@ -165,15 +300,14 @@ def change_password(payload):
     if not all([post_data.get("old_password"), post_data.get("new_password")]):
         return jsonify({"message": "Missing fields: old_password, new_password"}), 400
 
-    if bcrypt.checkpw(post_data.get("old_password").encode(), user["password"]):
-        hashed_password = bcrypt.hashpw(
-            post_data.get("new_password").encode(), bcrypt.gensalt()
-        )
+    if check_password(post_data.get("old_password"), user["password"]):
+        hashed_password = hash_password(post_data.get("new_password"))
 
         collection.update_one(
             {"_id": ObjectId(payload["sub"])},
             {"$set": {"password": hashed_password}},
         )
+        invalidate_user(payload["sub"])
         return jsonify({"message": "Senha alterada com sucesso."}), 200
 
     return jsonify({"message": "Senha antiga inválida."}), 400
@@ -194,3 +328,9 @@ def change_password(payload):
 
 #     users.update_one({"email": post_data.get("email")}, {"$set": {"password": hashed_password}})
 #     return jsonify({"message": "Senha alterada com sucesso."}), 200
+
+
+@auth.cli.command("create-indexes")
+def create_indexes():
+    """Cria o índice TTL que remove os baldes de rate limit parados."""
+    print(rate_limits.create_index("expires_at", expireAfterSeconds=0))
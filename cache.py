@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from pymongo.collection import Collection
+
+
+class InvalidationChannel:
+    """Contador de versão no MongoDB compartilhado entre os workers.
+
+    Quem escreve chama `publish`; cada worker consulta a versão no máximo
+    uma vez a cada `interval` segundos e descarta o cache local se ela mudou.
+    """
+
+    def __init__(self, collection: Collection, name: str, interval: float = 2.0):
+        self.collection = collection
+        self.name = name
+        self.interval = interval
+
+        self._version = None
+        self._checked_at = 0.0
+
+    def publish(self):
+        self.collection.update_one(
+            {"_id": self.name}, {"$inc": {"version": 1}}, upsert=True
+        )
+
+    def changed(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < self.interval:
+            return False
+
+        self._checked_at = now
+        doc = self.collection.find_one({"_id": self.name}) or {}
+        version = doc.get("version", 0)
+        changed = self._version is not None and version != self._version
+        self._version = version
+        return changed
+
+
+class TTLCache:
+    """Cache LRU com expiração por tempo, seguro para uso entre threads.
+
+    Cada worker do gunicorn tem a sua própria instância; os valores
+    guardados nunca devem ser modificados por quem os lê.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        channel: Optional[InvalidationChannel] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.channel = channel
+        self.hits = 0
+        self.misses = 0
+
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if self.channel is not None and self.channel.changed():
+            self.clear()
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Retorna o valor em cache ou o carrega; resultados None não são guardados."""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def invalidate(self):
+        """Limpa o cache local e avisa os outros workers, se houver canal."""
+        self.clear()
+        if self.channel is not None:
+            self.channel.publish()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,13 +1,37 @@
 from datetime import date
 from decimal import Decimal
+from typing import Optional
 
-from pydantic import BaseModel, EmailStr, Field, field_validator
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    EmailStr,
+    Field,
+    field_validator,
+    model_validator,
+)
 
+from products.images import REF_RE
 
-class SpeciesModel(BaseModel):
-    name_species: str
+
+class SpeciesPriceModel(BaseModel):
     price: Decimal
-    picture: str
+
+    @field_validator("price")
+    def price_must_be_positive(cls, v):
+        if v <= 0:
+            raise ValueError("The price must be greater than zero.")
+        return v
+
+
+class SpeciesModel(SpeciesPriceModel):
+    # Campos fora do modelo (scientificName, tags, ...) são mantidos
+    model_config = ConfigDict(extra="allow")
+
+    name: str
+    # Referência "<sha256>.<ext>" de POST /prods/images; `picture` é o formato antigo
+    image: Optional[str] = None
+    picture: Optional[str] = None
     description: str
     ecosystem: str
     feeding: str
@@ -17,22 +41,28 @@ class SpeciesModel(BaseModel):
     origin: str
     social_behavior: str
 
-    @field_validator("price")
-    def price_must_be_positive(cls, v):
-        if v <= 0:
-            raise ValueError("The price must be greater than zero.")
+    @field_validator("image")
+    def image_must_be_a_ref(cls, v):
+        if v is not None and not REF_RE.match(v):
+            raise ValueError("Invalid image reference.")
         return v
 
+    @model_validator(mode="after")
+    def image_or_picture_required(self):
+        if self.image is None and self.picture is None:
+            raise ValueError("Either 'image' or 'picture' is required.")
+        return self
+
 
 class CustomerModel(BaseModel):
     is_company: bool
     name: str
     email: EmailStr
-    cellphone: str = Field(..., regex=r"^\d{11}$")
+    cellphone: str = Field(..., pattern=r"^\d{11}$")
     birth_date: date
     rg: int
-    cpf: str = Field(..., regex=r"^\d{11}$")
-    cnpj: str = Field(None, regex=r"^\d{14}$")
+    cpf: str = Field(..., pattern=r"^\d{11}$")
+    cnpj: str = Field(None, pattern=r"^\d{14}$")
     serial_cc: str = Field(..., min_length=16, max_length=16)
     expiration_cc: str = Field(..., min_length=5, max_length=5)
     backserial_cc: str = Field(..., min_length=3, max_length=3)
@@ -50,7 +80,7 @@ class EmployeeModel(BaseModel):
     cellphone: str
     birth_date: date
     rg: str
-    cpf: str = Field(..., regex=r"^\d{11}$")
+    cpf: str = Field(..., pattern=r"^\d{11}$")
     status: str
     job_sector: str
     job_title: str
@@ -1,11 +1,13 @@
-from flask import Blueprint, jsonify, send_file
+from flask import Blueprint, jsonify
 from datetime import datetime, timedelta
 from connections import db
 from bson.decimal128 import Decimal128
 from bson import ObjectId
 import bson
-import io
 from fpdf import FPDF
+from jobs.runner import JobResult
+from jobs.views import enqueue_job
+from sales import rollup
 
 # Definindo o Blueprint
 dashboard = Blueprint("dashboard", __name__)
@@ -15,18 +17,12 @@ order_collection = db['orders']
 client_collection = db['users']
 
 def calculate_order_total(order):
-    total = 0
-    for item in order.get('items', []):
-        price = item.get('price', 0)
-        qty = item.get('qty', 0)
+    # Subtotal dos itens, gravado no pedido por Sale.to_bson (ou por `flask sales backfill-totals`)
+    subtotal = order.get('subtotal', 0)
+    if isinstance(subtotal, Decimal128):
+        subtotal = float(subtotal.to_decimal())
 
-        # Converte Decimal128 para float, se necessário
-        if isinstance(price, Decimal128):
-            price = float(price.to_decimal())
-
-        total += price * qty
-
-    return round(total, 2)
+    return round(subtotal, 2)
 
 def to_dict(order):
     customer_data = order.get("customer", {})
@@ -64,28 +60,16 @@ def serialize_document(doc):
 @dashboard.route('/order', methods=['GET'])
 def order():
     hoje = datetime.now()
-    primeiro_dia_do_mes = hoje.replace(day=1)
+    primeiro_dia_do_mes = hoje.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     ultimo_mes = primeiro_dia_do_mes - timedelta(days=1)
     primeiro_dia_ultimo_mes = ultimo_mes.replace(day=1)
 
-    # Vendas do mês atual
-    vendas_do_mes = list(order_collection.find({
-        "date": {"$gte": primeiro_dia_do_mes}
-    }))
-
-    total_vendas = round(sum(calculate_order_total(order) for order in vendas_do_mes), 2)
-
-    # Clientes atingidos
-    clientes_atingidos = set(order.get('customer', {}).get('_id') for order in vendas_do_mes)
-
-    # Compras realizadas
-    total_compras = len(vendas_do_mes)
+    # Totais diários mantidos por sales.rollup: o custo depende do número de dias
+    atual = rollup.summarize(rollup.find_days(primeiro_dia_do_mes))
+    anterior = rollup.summarize(rollup.find_days(primeiro_dia_ultimo_mes, primeiro_dia_do_mes))
 
-    # Vendas do mês anterior
-    vendas_ultimo_mes = list(order_collection.find({
-        "date": {"$gte": primeiro_dia_ultimo_mes, "$lt": primeiro_dia_do_mes}
-    }))
-    total_vendas_ultimo_mes = sum(calculate_order_total(order) for order in vendas_ultimo_mes)
+    total_vendas = round(float(atual["revenue"]), 2)
+    total_vendas_ultimo_mes = float(anterior["revenue"])
 
     # Aumento percentual
     aumento_em_porcentagem = 0.0
@@ -95,11 +79,11 @@ def order():
     relatorio = {
         "total_vendas": total_vendas,
         "aumento_em_porcentagem": aumento_em_porcentagem,
-        "clientes_atingidos": len(clientes_atingidos),
-        "total_compras_realizadas": total_compras,
+        "clientes_atingidos": atual["customers"],
+        "total_compras_realizadas": atual["orders"],
     }
 
-    return jsonify(serialize_document(relatorio))
+    return jsonify(relatorio)
 
 @dashboard.route('/order/top3/<string:period>', methods=['GET'])
 def get_top_3(period):
@@ -132,32 +116,19 @@ def get_top_3(period):
     else:
         return jsonify({"error": "Período inválido"}), 400
 
+    # Os maiores pedidos precisam dos próprios pedidos, não dos totais diários;
+    # o $match usa o índice em `date` e $sort + $limit guarda só 3 em memória
     top_orders_pipeline = [
         {"$match": {"date": {"$gte": start_date, "$lt": end_date}}},
-        {"$addFields": {"order_total": {
-            "$sum": {"$map": {
-                "input": {"$cond": {"if": {"$isArray": "$items"}, "then": "$items", "else": []}},
-                "as": "item",
-                "in": {"$multiply": ["$$item.price", "$$item.qty"]}
-            }}
-        }}},
+        {"$addFields": {"order_total": "$subtotal"}},
         {"$sort": {"order_total": -1}},
         {"$limit": 3},
-        {
-            "$lookup": {
-                "from": "users",  # Nome da coleção de clientes
-                "localField": "customer_id",  # Campo local em orders
-                "foreignField": "_id",  # Campo correspondente em users
-                "as": "customer_info"
-            }
-        },
         {
             "$addFields": {
-                "customer_name": {"$arrayElemAt": ["$customer_info.name", 0]},  # Nome do cliente
-                "seller_name": {"$arrayElemAt": ["$customer_info.surname", 0]}  # Nome do vendedor ou outro campo caso se aplique
+                "customer_name": "$customer.name",  # Snapshot do cliente gravado no pedido
+                "seller_name": "$customer.surname"  # Nome do vendedor ou outro campo caso se aplique
             }
-        },
-        {"$project": {"customer_info": 0}}
+        }
     ]
 
     top_orders = list(order_collection.aggregate(top_orders_pipeline))
@@ -167,27 +138,20 @@ def get_top_3(period):
 @dashboard.route('/annual-sales', methods=['GET'])
 def get_annual_sales_data():
     start_of_year = datetime(datetime.now().year, 1, 1)
+    # Agrupa os totais diários (no máximo 366 documentos) por mês
     monthly_sales_pipeline = [
-    {"$match": {"date": {"$gte": start_of_year}}},
-    {"$unwind": "$items"},
+    {"$match": {"_id": {"$gte": start_of_year}}},
     {
         "$group": {
-            "_id": {"month": {"$month": "$date"}},
-            "total_sales": {
-                "$sum": {
-                    "$multiply": [
-                        {"$toDouble": "$items.price"},  # Converte para double
-                        "$items.qty"
-                    ]
-                }
-            }
+            "_id": {"month": {"$month": "$_id"}},
+            "total_sales": {"$sum": {"$toDouble": "$revenue"}}
         }
     },
     {"$sort": {"_id.month": 1}}
 ]
 
 
-    monthly_sales_data = list(order_collection.aggregate(monthly_sales_pipeline))
+    monthly_sales_data = list(rollup.COLLECTION.aggregate(monthly_sales_pipeline))
 
     sales = {
         month["_id"]["month"]: float(month.get("total_sales", 0))
@@ -195,71 +159,52 @@ def get_annual_sales_data():
     }
     return jsonify(sales)
 
+def build_backup():
+    sales_data = list(order_collection.find())
+    products_data = list(db['products'].find())
+    backup_content = {
+        'sales': sales_data,
+        'products': products_data
+    }
+    return JobResult(
+        bson.encode(backup_content),
+        mimetype='application/octet-stream',
+        download_name='backup_dados.bson'
+    )
+
 @dashboard.route('/backup', methods=['GET'])
 def backup_data():
-    try:
-        sales_data = list(order_collection.find())
-        products_data = list(db['products'].find())
-        backup_content = {
-            'sales': sales_data,
-            'products': products_data
-        }
-        bson_data = bson.encode(backup_content)
-        return send_file(
-            io.BytesIO(bson_data),
-            mimetype='application/octet-stream',
-            as_attachment=True,
-            download_name='backup_dados.bson'
-        )
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-import tempfile
-import os
+    return enqueue_job('dash.backup', build_backup)
+
+def build_export():
+    # Buscar dados de pedidos
+    orders = list(order_collection.find())
+
+    if not orders:
+        raise ValueError("Nenhuma venda encontrada para exportar.")
+
+    # Criar o PDF
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    pdf.set_font('Arial', size=12)
+    pdf.cell(200, 10, txt="Relatório de Vendas", ln=True, align='C')
+
+    for order in orders:
+        order_total = calculate_order_total(order)
+        pdf.ln(10)
+        pdf.cell(0, 10, f"ID: {order.get('_id', '')}", ln=True)
+        pdf.cell(0, 10, f"Cliente: {order.get('customer', {}).get('name', 'Não informado')}", ln=True)
+        pdf.cell(0, 10, f"Data: {order.get('date').strftime('%d/%m/%Y') if order.get('date') else 'Não informado'}", ln=True)
+        pdf.cell(0, 10, f"Total: R$ {order_total:.2f}", ln=True)
+
+    # Gerado em memória, sem arquivo temporário
+    return JobResult(
+        pdf.output(dest='S').encode('latin-1'),
+        mimetype='application/pdf',
+        download_name='relatorio_vendas.pdf'
+    )
 
 @dashboard.route('/export', methods=['GET'])
 def export_data():
-    try:
-        # Buscar dados de pedidos
-        orders = list(order_collection.find())
-
-        if not orders:
-            raise ValueError("Nenhuma venda encontrada para exportar.")
-
-        # Criar o PDF
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.add_page()
-        pdf.set_font('Arial', size=12)
-        pdf.cell(200, 10, txt="Relatório de Vendas", ln=True, align='C')
-
-        for order in orders:
-            order_total = calculate_order_total(order)
-            pdf.ln(10)
-            pdf.cell(0, 10, f"ID: {order.get('_id', '')}", ln=True)
-            pdf.cell(0, 10, f"Cliente: {order.get('customer', {}).get('name', 'Não informado')}", ln=True)
-            pdf.cell(0, 10, f"Data: {order.get('date').strftime('%d/%m/%Y') if order.get('date') else 'Não informado'}", ln=True)
-            pdf.cell(0, 10, f"Total: R$ {order_total:.2f}", ln=True)
-
-        # Criar um arquivo temporário
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-            pdf.output(temp_file.name)
-            temp_file_path = temp_file.name
-
-        # Enviar o arquivo para o cliente
-        return send_file(
-            temp_file_path,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name='relatorio_vendas.pdf'
-        )
-    except Exception as e:
-        print(f"Erro ao exportar dados: {str(e)}")
-        return jsonify({"error": str(e)}), 500
-    finally:
-        # Remover o arquivo temporário após o envio
-        try:
-            if 'temp_file_path' in locals() and os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-        except Exception as cleanup_error:
-            print(f"Erro ao limpar arquivo temporário: {cleanup_error}")
+    return enqueue_job('dash.export', build_export)
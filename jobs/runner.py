@@ -0,0 +1,181 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from os import environ
+from typing import Any, Callable, Optional
+
+from bson import ObjectId
+
+from connections import db
+
+JOBS = db["jobs"]
+
+JOB_DIR = environ.get("JOB_DIR", "/tmp/fishnet/jobs")
+JOB_WORKERS = int(environ.get("JOB_WORKERS", 2))
+JOB_QUEUE_LIMIT = int(environ.get("JOB_QUEUE_LIMIT", 16))
+JOB_RETENTION = int(environ.get("JOB_RETENTION", 24 * 60 * 60))
+# Tarefas na fila ou rodando há mais que isso se perderam (worker reiniciado)
+JOB_TIMEOUT = int(environ.get("JOB_TIMEOUT", 60 * 60))
+
+log = logging.getLogger(__name__)
+
+# Poucas threads por worker do gunicorn: as tarefas pesadas nunca ocupam
+# mais que JOB_WORKERS threads, e no máximo JOB_QUEUE_LIMIT ficam na fila
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_slots = threading.BoundedSemaphore(JOB_QUEUE_LIMIT)
+
+# Os arquivos de resultado somem junto com o registro (índice TTL em `created_at`)
+SWEEP_INTERVAL = int(environ.get("JOB_SWEEP_INTERVAL", 10 * 60))
+_swept_at = 0.0
+
+
+class QueueFullError(Exception):
+    pass
+
+
+@dataclass
+class JobResult:
+    data: bytes
+    mimetype: str
+    download_name: str
+
+
+def enqueue(kind: str, fn: Callable[..., JobResult], *args: Any) -> ObjectId:
+    """Registra a tarefa no MongoDB e a agenda no pool.
+
+    Lança QueueFullError se já houver JOB_QUEUE_LIMIT tarefas pendentes.
+    """
+    if not _slots.acquire(blocking=False):
+        raise QueueFullError("Too many jobs in progress, try again later")
+
+    maybe_sweep()
+
+    try:
+        job_id = JOBS.insert_one(
+            {"kind": kind, "status": "queued", "created_at": datetime.now()}
+        ).inserted_id
+        _executor.submit(_run, job_id, fn, args)
+    except Exception:
+        _slots.release()
+        raise
+
+    return job_id
+
+
+def _run(job_id: ObjectId, fn: Callable[..., JobResult], args: tuple):
+    try:
+        JOBS.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "running", "started_at": datetime.now()}},
+        )
+        result = fn(*args)
+
+        os.makedirs(JOB_DIR, exist_ok=True)
+        path = os.path.join(JOB_DIR, str(job_id))
+        with open(path, "wb") as f:
+            f.write(result.data)
+
+        JOBS.update_one(
+            {"_id": job_id},
+            {
+                "$set": {
+                    "status": "done",
+                    "finished_at": datetime.now(),
+                    "path": path,
+                    "mimetype": result.mimetype,
+                    "download_name": result.download_name,
+                    "size": len(result.data),
+                }
+            },
+        )
+    except Exception as e:
+        log.exception("Job %s failed", job_id)
+        JOBS.update_one(
+            {"_id": job_id},
+            {
+                "$set": {
+                    "status": "failed",
+                    "finished_at": datetime.now(),
+                    "error": str(e),
+                }
+            },
+        )
+    finally:
+        _slots.release()
+
+
+def sweep(retention: int = JOB_RETENTION) -> int:
+    """Apaga os arquivos de resultado mais antigos que `retention` segundos."""
+    if not os.path.isdir(JOB_DIR):
+        return 0
+
+    removed = 0
+    limit = time.time() - retention
+    for entry in os.scandir(JOB_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < limit:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass  # outro worker já apagou
+    return removed
+
+
+def fail_stale(job_id: Optional[ObjectId] = None) -> int:
+    """Marca como falhas as tarefas paradas há mais de JOB_TIMEOUT segundos.
+
+    O pool vive no processo do worker: se ele reinicia, as tarefas dele ficam
+    `queued` ou `running` para sempre.
+    """
+    limit = datetime.now() - timedelta(seconds=JOB_TIMEOUT)
+    query = {
+        "$or": [
+            {"status": "queued", "created_at": {"$lt": limit}},
+            {"status": "running", "started_at": {"$lt": limit}},
+        ]
+    }
+    if job_id is not None:
+        query["_id"] = job_id
+
+    result = JOBS.update_many(
+        query,
+        {
+            "$set": {
+                "status": "failed",
+                "finished_at": datetime.now(),
+                "error": "Job did not finish in time",
+            }
+        },
+    )
+    return result.modified_count
+
+
+def maybe_sweep():
+    """Roda `sweep` e `fail_stale` no máximo uma vez a cada SWEEP_INTERVAL segundos."""
+    global _swept_at
+    now = time.monotonic()
+    if now - _swept_at >= SWEEP_INTERVAL:
+        _swept_at = now
+        sweep()
+        fail_stale()
+
+
+def _is_stale(job: dict[str, Any]) -> bool:
+    if job["status"] == "queued":
+        since = job["created_at"]
+    elif job["status"] == "running":
+        since = job.get("started_at", job["created_at"])
+    else:
+        return False
+    return since < datetime.now() - timedelta(seconds=JOB_TIMEOUT)
+
+
+def get(job_id: ObjectId) -> Optional[dict[str, Any]]:
+    job = JOBS.find_one({"_id": job_id})
+    if job is not None and _is_stale(job) and fail_stale(job_id):
+        job = JOBS.find_one({"_id": job_id})
+    return job
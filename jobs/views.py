@@ -0,0 +1,91 @@
+import os
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Blueprint, jsonify, send_file
+
+from jobs import runner
+
+jobs = Blueprint("jobs", __name__)
+
+
+def enqueue_job(kind, fn, *args):
+    """Enfileira a tarefa e responde 202 com o id, ou 503 se a fila estiver cheia."""
+    try:
+        job_id = runner.enqueue(kind, fn, *args)
+    except runner.QueueFullError as e:
+        return jsonify({"message": str(e)}), 503, {"Retry-After": "30"}
+
+    return (
+        jsonify({"job_id": str(job_id), "status_url": f"/jobs/{job_id}"}),
+        202,
+        {"Location": f"/jobs/{job_id}"},
+    )
+
+
+def find_job(id):
+    try:
+        return runner.get(ObjectId(id))
+    except InvalidId:
+        return None
+
+
+@jobs.get("/<id>")
+def get_job(id):
+    job = find_job(id)
+    if job is None:
+        return jsonify({"message": "Job not found"}), 404
+
+    response = {
+        "_id": str(job["_id"]),
+        "kind": job["kind"],
+        "status": job["status"],
+        "created_at": job["created_at"].isoformat(),
+    }
+    for field in ["started_at", "finished_at"]:
+        if field in job:
+            response[field] = job[field].isoformat()
+    if job["status"] == "failed":
+        response["error"] = job.get("error")
+    if job["status"] == "done":
+        response["download_url"] = f"/jobs/{id}/download"
+        response["size"] = job["size"]
+
+    return jsonify(response), 200
+
+
+@jobs.get("/<id>/download")
+def download_job(id):
+    job = find_job(id)
+    if job is None:
+        return jsonify({"message": "Job not found"}), 404
+
+    if job["status"] != "done":
+        return jsonify({"message": f"Job is {job['status']}"}), 409
+
+    if not os.path.exists(job["path"]):
+        return jsonify({"message": "Job result expired"}), 410
+
+    return send_file(
+        job["path"],
+        mimetype=job["mimetype"],
+        as_attachment=True,
+        download_name=job["download_name"],
+    )
+
+
+@jobs.cli.command("create-indexes")
+def create_indexes():
+    """Cria o índice TTL que remove os registros de tarefas antigas."""
+    print(
+        runner.JOBS.create_index(
+            "created_at", expireAfterSeconds=runner.JOB_RETENTION
+        )
+    )
+
+
+@jobs.cli.command("sweep")
+def sweep_results():
+    """Apaga os resultados antigos e marca como falhas as tarefas perdidas."""
+    print(f"{runner.sweep()} files removed")
+    print(f"{runner.fail_stale()} stale jobs failed")
@@ -2,10 +2,12 @@ from os import environ
 from dotenv import load_dotenv
 from flask import Flask
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from admin.views import admin
 from auth.views import auth
 from dashboard.dash import dashboard
+from jobs.views import jobs
 from products.views import products
 from sales.views import sales
 from user.views import users
@@ -17,6 +19,10 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app, origins="*")
 
+# Atrás do proxy da Render o IP do cliente vem em X-Forwarded-For;
+# TRUSTED_PROXIES é o número de proxies confiáveis na frente do app
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(environ.get("TRUSTED_PROXIES", 1)))
+
 app.config["CORS_HEADERS"] = "Content-Type"
 app.config["SECRET_KEY"] = environ.get("SECRET_KEY", ":^)")
 
@@ -27,6 +33,7 @@ app.register_blueprint(products, url_prefix="/prods")
 app.register_blueprint(dashboard, url_prefix="/dash")
 app.register_blueprint(sales, url_prefix="/sales")
 app.register_blueprint(admin, url_prefix="/admin")
+app.register_blueprint(jobs, url_prefix="/jobs")
 
 @app.get("/")
 def home():
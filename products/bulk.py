@@ -0,0 +1,109 @@
+from typing import Any
+
+from bson import Decimal128, ObjectId
+from bson.errors import InvalidId
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from crud.models import SpeciesModel, SpeciesPriceModel
+
+OPERATIONS = ("insert", "upsert", "price", "delete")
+# Operações que só fazem sentido sobre uma espécie existente
+EXISTING_ONLY = ("price", "delete")
+
+
+def species_document(raw: Any) -> dict[str, Any]:
+    species = SpeciesModel.model_validate(raw)
+    doc = species.model_dump(exclude_none=True)
+    doc.pop("_id", None)
+    doc["price"] = Decimal128(species.price)
+    return doc
+
+
+def to_write(item: Any) -> tuple[ObjectId, Any]:
+    """Valida um item do lote e o converte na operação de escrita correspondente.
+
+    Formatos aceitos:
+        {"op": "insert", "doc": {...}}
+        {"op": "upsert", "id": "...", "doc": {...}}
+        {"op": "price", "id": "...", "price": 12.5}
+        {"op": "delete", "id": "..."}
+    """
+    if not isinstance(item, dict) or item.get("op") not in OPERATIONS:
+        raise ValueError(f"Invalid op, expected one of: {', '.join(OPERATIONS)}")
+
+    op = item["op"]
+    if op == "insert":
+        _id = ObjectId()
+        return _id, InsertOne({**species_document(item.get("doc")), "_id": _id})
+
+    if not item.get("id"):
+        raise ValueError("Missing field 'id'")
+    _id = ObjectId(item["id"])
+
+    if op == "upsert":
+        # $set preserva campos que não vieram no item (image, quantity, ...)
+        doc = species_document(item.get("doc"))
+        update = {"$set": doc}
+        if "image" in doc:
+            # A imagem nova substitui a antiga embutida
+            update["$unset"] = {"picture": ""}
+        return _id, UpdateOne({"_id": _id}, update, upsert=True)
+
+    if op == "price":
+        price = SpeciesPriceModel(price=item.get("price")).price
+        return _id, UpdateOne({"_id": _id}, {"$set": {"price": Decimal128(price)}})
+
+    return _id, DeleteOne({"_id": _id})
+
+
+def apply_bulk(
+    collection: Collection, items: list[Any], chunk_size: int
+) -> list[dict[str, Any]]:
+    """Aplica o lote com `bulk_write` não ordenado, em blocos de `chunk_size`.
+
+    Retorna um resultado por item, na mesma ordem da entrada. `price` e
+    `delete` sobre ids inexistentes voltam com status `not_found`.
+    """
+    results = []
+    pending = []
+
+    for index, item in enumerate(items):
+        op = item.get("op") if isinstance(item, dict) else None
+        try:
+            _id, write = to_write(item)
+        except (ValueError, TypeError, InvalidId) as e:
+            results.append({"index": index, "op": op, "status": "error", "error": str(e)})
+            continue
+
+        results.append({"index": index, "op": op, "id": str(_id), "status": "ok"})
+        pending.append((index, _id, op, write))
+
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start : start + chunk_size]
+
+        # O bulk_write só informa totais; os ids inexistentes são lidos antes
+        targets = [_id for _, _id, op, _ in chunk if op in EXISTING_ONLY]
+        if targets:
+            found = {
+                doc["_id"]
+                for doc in collection.find({"_id": {"$in": targets}}, {"_id": 1})
+            }
+            for index, _id, op, _ in chunk:
+                if op in EXISTING_ONLY and _id not in found:
+                    results[index].update(
+                        status="not_found", error="Species not found"
+                    )
+            chunk = [entry for entry in chunk if results[entry[0]]["status"] == "ok"]
+
+        if not chunk:
+            continue
+        try:
+            collection.bulk_write([write for *_, write in chunk], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                index = chunk[error["index"]][0]
+                results[index].update(status="error", error=error["errmsg"])
+
+    return results
@@ -0,0 +1,85 @@
+import os
+import re
+import tempfile
+from hashlib import sha256
+from io import BytesIO
+from os import environ
+from typing import Optional
+
+from PIL import Image, UnidentifiedImageError
+
+# Diretório local que faz o papel do bucket de imagens
+IMAGE_ROOT = environ.get("IMAGE_STORE", "/tmp/fishnet/images")
+MAX_IMAGE_BYTES = int(environ.get("MAX_IMAGE_BYTES", 5 * 1024 * 1024))
+THUMBNAIL_SIZES = (64, 256, 512)
+
+FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+MIMETYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+
+# Referência guardada no documento da espécie: "<sha256>.<ext>"
+REF_RE = re.compile(r"^([0-9a-f]{64})\.(jpg|png|webp|gif)$")
+
+
+def url_for_ref(ref: str) -> str:
+    return f"/prods/images/{ref}"
+
+
+def path_for(ref: str, size: Optional[int] = None) -> str:
+    """Caminho no disco da imagem original ou de uma miniatura. Lança ValueError se `ref` for inválida."""
+    match = REF_RE.match(ref)
+    if match is None:
+        raise ValueError("Invalid image reference")
+    if size is not None and size not in THUMBNAIL_SIZES:
+        raise ValueError(f"Invalid size, expected one of: {THUMBNAIL_SIZES}")
+
+    digest = match.group(1)
+    name = ref if size is None else f"{digest}_{size}.webp"
+    return os.path.join(IMAGE_ROOT, digest[:2], name)
+
+
+def mimetype_for(ref: str, size: Optional[int] = None) -> str:
+    return "image/webp" if size is not None else MIMETYPES[ref.rsplit(".", 1)[1]]
+
+
+def _write(path: str, data: bytes):
+    # Escreve num arquivo temporário e renomeia, para nunca servir um arquivo pela metade
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def store(data: bytes) -> str:
+    """Guarda a imagem pelo hash do conteúdo, gera as miniaturas e retorna a referência."""
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ValueError(f"Image larger than {MAX_IMAGE_BYTES} bytes")
+
+    try:
+        image = Image.open(BytesIO(data))
+        image.load()
+    except Image.DecompressionBombError:
+        raise ValueError("Image dimensions too large")
+    except (UnidentifiedImageError, OSError):
+        raise ValueError("Invalid image")
+
+    if image.format not in FORMATS:
+        raise ValueError(f"Unsupported image format: {image.format}")
+
+    ref = f"{sha256(data).hexdigest()}.{FORMATS[image.format]}"
+    if os.path.exists(path_for(ref)):
+        return ref
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    for size in THUMBNAIL_SIZES:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((size, size))
+        buffer = BytesIO()
+        thumbnail.save(buffer, format="WEBP")
+        _write(path_for(ref, size), buffer.getvalue())
+
+    # O original por último: a existência dele indica que o conjunto está completo
+    _write(path_for(ref), data)
+    return ref
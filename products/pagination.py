@@ -0,0 +1,56 @@
+import base64
+import json
+from decimal import InvalidOperation
+from typing import Any
+
+from bson import Decimal128, ObjectId
+from bson.errors import InvalidId
+import pymongo
+
+# Campos que podem servir de chave para a paginação por cursor
+SORT_FIELDS = ("name", "price", "_id")
+
+
+def encode_cursor(field: str, direction: int, doc: dict[str, Any]) -> str:
+    value = doc[field]
+    if isinstance(value, Decimal128):
+        value = str(value.to_decimal())
+    elif isinstance(value, ObjectId):
+        value = str(value)
+
+    raw = json.dumps([field, direction, value, str(doc["_id"])], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple[str, int, Any, ObjectId]:
+    """Decodifica um token gerado por `encode_cursor`. Lança ValueError se for inválido."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        field, direction, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+        last_id = ObjectId(last_id)
+
+        if field == "_id":
+            value = last_id
+        elif not isinstance(value, str):
+            raise ValueError
+        elif field == "price":
+            value = Decimal128(value)
+    except (ValueError, TypeError, InvalidId, InvalidOperation):
+        raise ValueError("Invalid cursor")
+
+    if field not in SORT_FIELDS or direction not in (
+        pymongo.ASCENDING,
+        pymongo.DESCENDING,
+    ):
+        raise ValueError("Invalid cursor")
+
+    return field, direction, value, last_id
+
+
+def seek_filter(field: str, direction: int, value: Any, last_id: ObjectId) -> dict:
+    """Filtro que posiciona a consulta logo após a última chave vista."""
+    op = "$gt" if direction == pymongo.ASCENDING else "$lt"
+    if field == "_id":
+        return {"_id": {op: last_id}}
+
+    return {"$or": [{field: {op: value}}, {field: value, "_id": {op: last_id}}]}
@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from hashlib import blake2b
+from typing import Any
+
+from flask import Response, current_app, request
+
+
+@dataclass(frozen=True)
+class CachedBody:
+    """Resposta JSON já serializada, com a versão (hash do conteúdo) calculada uma vez."""
+
+    data: Any
+    body: bytes
+    etag: str
+    last_modified: datetime
+
+
+def freeze(data: Any) -> CachedBody:
+    body = current_app.json.dumps(data).encode()
+    return CachedBody(
+        data,
+        body,
+        blake2b(body, digest_size=16).hexdigest(),
+        datetime.now(timezone.utc).replace(microsecond=0),
+    )
+
+
+def conditional_response(entry: CachedBody) -> Response:
+    """Monta a resposta com ETag/Last-Modified; vira 304 se o cliente já tem essa versão."""
+    response = current_app.response_class(entry.body, mimetype="application/json")
+    response.set_etag(entry.etag)
+    response.last_modified = entry.last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
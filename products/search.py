@@ -0,0 +1,163 @@
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Any, Callable, Iterable, Optional
+
+from cache import InvalidationChannel
+
+# Peso de cada campo no ranqueamento
+FIELD_WEIGHTS = {"name": 3.0, "scientificName": 2.0, "tags": 1.0}
+# Termos que só batem por prefixo valem menos que termos exatos
+PREFIX_PENALTY = 0.5
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    """Remove acentos e converte para minúsculas ("Peixe-Palhaço" -> "peixe-palhaco")."""
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in normalized if not unicodedata.combining(c)).lower()
+
+
+def tokenize(value: Any) -> list[str]:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [token for v in value for token in tokenize(v)]
+    return TOKEN_RE.findall(fold(str(value)))
+
+
+class SearchIndex:
+    """Índice invertido em memória sobre a coleção de espécies.
+
+    O índice é carregado preguiçosamente pelo `loader` na primeira busca e
+    mantido atualizado pelas rotas de escrita através de `add` e `remove`.
+    Como `add`/`remove` só alcançam o worker que tratou a escrita, o índice é
+    recarregado na busca seguinte quando o `channel` muda de versão ou quando
+    passa `ttl` segundos desde o último carregamento.
+    """
+
+    PROJECTION = {field: 1 for field in FIELD_WEIGHTS}
+
+    def __init__(
+        self,
+        loader: Callable[[], Iterable[dict]],
+        weights=FIELD_WEIGHTS,
+        ttl: float = 300.0,
+        channel: Optional[InvalidationChannel] = None,
+    ):
+        self.loader = loader
+        self.weights = weights
+        self.ttl = ttl
+        self.channel = channel
+        self.ready = False
+        self.loaded_at = 0.0
+
+        self._lock = threading.RLock()
+        self._postings: dict[str, dict[str, float]] = defaultdict(dict)
+        self._doc_tokens: dict[str, set[str]] = {}
+        self._sort_keys: dict[str, str] = {}
+        self._vocab: list[str] = []
+
+    def rebuild(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_tokens.clear()
+            self._sort_keys.clear()
+            self._vocab.clear()
+
+            for doc in self.loader():
+                self._index(doc)
+
+            self._vocab = sorted(self._postings)
+            self.ready = True
+            self.loaded_at = time.monotonic()
+
+    def stale(self) -> bool:
+        if not self.ready:
+            return True
+        if self.channel is not None and self.channel.changed():
+            return True
+        return time.monotonic() - self.loaded_at > self.ttl
+
+    def add(self, doc: dict):
+        """Indexa (ou reindexa) um documento. Ignorado até o primeiro carregamento."""
+        with self._lock:
+            if not self.ready:
+                return
+            self._unindex(str(doc["_id"]))
+            for token in self._index(doc):
+                i = bisect_left(self._vocab, token)
+                if i == len(self._vocab) or self._vocab[i] != token:
+                    insort(self._vocab, token)
+
+    def remove(self, doc_id):
+        with self._lock:
+            if self.ready:
+                self._unindex(str(doc_id))
+
+    def search(self, query: str) -> list[str]:
+        """Retorna os ids que contêm todos os termos da busca, do mais relevante ao menos."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            if self.stale():
+                self.rebuild()
+
+            scores = None
+            for term in terms:
+                term_scores = self._match(term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        doc_id: score + term_scores[doc_id]
+                        for doc_id, score in scores.items()
+                        if doc_id in term_scores
+                    }
+                if not scores:
+                    return []
+
+            return sorted(scores, key=lambda d: (-scores[d], self._sort_keys[d]))
+
+    def _match(self, term: str) -> dict[str, float]:
+        matches: dict[str, float] = {}
+        i = bisect_left(self._vocab, term)
+        while i < len(self._vocab) and self._vocab[i].startswith(term):
+            token = self._vocab[i]
+            factor = 1.0 if token == term else PREFIX_PENALTY
+            for doc_id, weight in self._postings[token].items():
+                matches[doc_id] = max(matches.get(doc_id, 0.0), weight * factor)
+            i += 1
+        return matches
+
+    def _index(self, doc: dict) -> set[str]:
+        doc_id = str(doc["_id"])
+        weights: dict[str, float] = defaultdict(float)
+        for field, weight in self.weights.items():
+            for token in tokenize(doc.get(field)):
+                weights[token] += weight
+
+        for token, weight in weights.items():
+            self._postings[token][doc_id] = weight
+
+        tokens = set(weights)
+        self._doc_tokens[doc_id] = tokens
+        self._sort_keys[doc_id] = fold(str(doc.get("name", "")))
+        return tokens
+
+    def _unindex(self, doc_id: str):
+        for token in self._doc_tokens.pop(doc_id, ()):
+            postings = self._postings[token]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[token]
+                i = bisect_left(self._vocab, token)
+                if i < len(self._vocab) and self._vocab[i] == token:
+                    del self._vocab[i]
+        self._sort_keys.pop(doc_id, None)
@@ -0,0 +1,50 @@
+from typing import Any, Iterable
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from connections import db
+from sales.validation import SaleStatus
+
+# Contador de unidades vendidas por espécie: { _id: <species id>, sold: <int> }
+COLLECTION = db["species_sold"]
+ORDERS = db["orders"]
+
+# Status de pedido que contam como venda ("completed" vem de pedidos antigos)
+SOLD_STATUSES = [SaleStatus.DONE.value, "completed"]
+
+
+def record(items: Iterable[tuple[ObjectId, int]], sign: int = 1, session=None):
+    """Soma (ou subtrai, com sign=-1) as quantidades de cada item aos contadores."""
+    ops = [
+        UpdateOne({"_id": _id}, {"$inc": {"sold": sign * qty}}, upsert=True)
+        for _id, qty in items
+    ]
+    if ops:
+        COLLECTION.bulk_write(ops, ordered=False, session=session)
+
+
+def record_status_change(
+    items: list[dict[str, Any]], old_status, new_status, session=None
+):
+    """Ajusta os contadores quando um pedido entra ou sai de um status de venda."""
+    was_sold = old_status in SOLD_STATUSES
+    is_sold = new_status in SOLD_STATUSES
+    if was_sold != is_sold:
+        record(((i["_id"], i["qty"]) for i in items), 1 if is_sold else -1, session)
+
+
+def get_many(ids: list[ObjectId]) -> dict[ObjectId, int]:
+    return {doc["_id"]: doc["sold"] for doc in COLLECTION.find({"_id": {"$in": ids}})}
+
+
+def rebuild():
+    """Recalcula todos os contadores a partir do histórico de pedidos."""
+    ORDERS.aggregate(
+        [
+            {"$match": {"status": {"$in": SOLD_STATUSES}}},
+            {"$unwind": "$items"},
+            {"$group": {"_id": "$items._id", "sold": {"$sum": "$items.qty"}}},
+            {"$out": COLLECTION.name},
+        ]
+    )
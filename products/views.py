@@ -1,28 +1,127 @@
+import base64
+import binascii
+import json
 from math import ceil
+from os import environ
 from bson import Decimal128, ObjectId
-from flask import Blueprint, jsonify, request
+from bson.errors import InvalidId
+from flask import Blueprint, jsonify, request, send_file
 import pymongo
 
+from cache import InvalidationChannel, TTLCache
 from connections import db
+from products.bulk import apply_bulk
+from products import images, sold
+from products.pagination import decode_cursor, encode_cursor, seek_filter
+from products.responses import conditional_response, freeze
+from projection import parse_fields
+from streaming import stream_response
+from products.search import SearchIndex
 
 products = Blueprint("products", __name__)
 collection = db["species"]
-orders_collection = db["orders"]
 
-
-# TODO: upload images to some storage bucket and store the URLs
+BULK_CHUNK_SIZE = int(environ.get("BULK_CHUNK_SIZE", 500))
+BATCH_MAX_IDS = int(environ.get("BATCH_MAX_IDS", 500))
+
+
+def catalog_channel():
+    """Canal de invalidação do catálogo, se CATALOG_CACHE_SYNC estiver definido.
+
+    Cada consumidor precisa da sua própria instância, pois `changed()` só
+    avisa uma vez por mudança de versão.
+    """
+    if not environ.get("CATALOG_CACHE_SYNC"):
+        return None
+    return InvalidationChannel(
+        db["cache_versions"],
+        "species",
+        float(environ.get("CATALOG_CACHE_SYNC_INTERVAL", 2)),
+    )
+
+
+# Recarregado quando outro worker altera o catálogo, ou após SEARCH_INDEX_TTL
+search_index = SearchIndex(
+    lambda: collection.find({}, SearchIndex.PROJECTION),
+    ttl=float(environ.get("SEARCH_INDEX_TTL", 300)),
+    channel=catalog_channel(),
+)
+
+# Cache local das respostas do catálogo, já serializadas por `to_dict`.
+# Com CATALOG_CACHE_SYNC definido, as escritas invalidam o cache de todos os workers.
+catalog_cache = TTLCache(
+    maxsize=int(environ.get("CATALOG_CACHE_SIZE", 1024)),
+    ttl=float(environ.get("CATALOG_CACHE_TTL", 300)),
+    channel=catalog_channel(),
+)
+
+
+SPECIES_FIELDS = {
+    "name",
+    "scientificName",
+    "price",
+    "picture",
+    "image",
+    "description",
+    "ecosystem",
+    "habitat",
+    "feeding",
+    "size",
+    "tank_size",
+    "velocity",
+    "origin",
+    "social_behavior",
+    "tags",
+    "lancamento",
+    "ofertas",
+    "quantity",
+}
+# Projeção das listagens quando `fields` não é informado
+LIST_FIELDS = ["name", "scientificName", "price", "picture", "tags", "ofertas"]
 
 
 def to_dict(item):
     item["_id"] = str(item["_id"])
-    item["price"] = float(item["price"].to_decimal())
+    if "price" in item:
+        item["price"] = float(item["price"].to_decimal())
+    if "image" in item:
+        item["picture"] = images.url_for_ref(item["image"])
     return item
 
 
+def list_projection():
+    projection = parse_fields(request.args.get("fields"), SPECIES_FIELDS, LIST_FIELDS)
+    if "picture" in projection:
+        projection["image"] = 1
+    return projection
+
+
+def find_species(id):
+    species = collection.find_one({"_id": ObjectId(id)})
+    return species and freeze(to_dict(species))
+
+
+def args_key(*prefix):
+    return (*prefix, tuple(sorted(request.args.items(multi=True))))
+
+
 @products.get("/")
 def get_species():
-    species = list(collection.find())
-    return jsonify([to_dict(f) for f in species]), 200
+    try:
+        projection = list_projection()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if "stream" in request.args:
+        return stream_response(
+            lambda size: collection.find({}, projection).batch_size(size), to_dict
+        )
+
+    species = catalog_cache.get_or_set(
+        args_key("all"),
+        lambda: freeze([to_dict(f) for f in collection.find({}, projection)]),
+    )
+    return conditional_response(species)
 
 
 @products.post("/new")
@@ -30,16 +129,143 @@ def post_species():
     species = request.get_json()
     species["price"] = Decimal128(species["price"])
     result = collection.insert_one(species)
+    search_index.add(species)
+    catalog_cache.invalidate()
     return jsonify(str(result.inserted_id)), 201
 
 
+@products.post("/bulk")
+def bulk_species():
+    items = request.get_json()
+    if not isinstance(items, list):
+        return jsonify({"error": "Expected a list of operations"}), 400
+
+    chunk_size = request.args.get("chunk", BULK_CHUNK_SIZE, type=int)
+    if chunk_size <= 0:
+        return jsonify({"error": "Invalid chunk size"}), 400
+
+    results = apply_bulk(collection, items, chunk_size)
+
+    # Atualiza o catálogo uma única vez para o lote inteiro
+    ok = [r for r in results if r["status"] == "ok"]
+    if search_index.ready:
+        written = [ObjectId(r["id"]) for r in ok if r["op"] != "delete"]
+        for doc in collection.find({"_id": {"$in": written}}, SearchIndex.PROJECTION):
+            search_index.add(doc)
+        for r in ok:
+            if r["op"] == "delete":
+                search_index.remove(r["id"])
+    catalog_cache.invalidate()
+
+    return jsonify({"results": results, "errors": len(results) - len(ok)}), 200
+
+
+@products.post("/images")
+def upload_image():
+    file = request.files.get("file")
+    if file is None:
+        return jsonify({"error": "Missing file"}), 400
+
+    try:
+        ref = images.store(file.read(images.MAX_IMAGE_BYTES + 1))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"image": ref, "url": images.url_for_ref(ref)}), 201
+
+
+@products.post("/<id>/image")
+def upload_species_image(id):
+    file = request.files.get("file")
+    if file is None:
+        return jsonify({"error": "Missing file"}), 400
+
+    try:
+        _id = ObjectId(id)
+    except InvalidId:
+        return jsonify({"error": "Invalid id"}), 400
+
+    # Confere a espécie antes de gravar, para não deixar arquivo órfão
+    if not collection.count_documents({"_id": _id}, limit=1):
+        return jsonify({"error": "Species not found"}), 404
+
+    try:
+        ref = images.store(file.read(images.MAX_IMAGE_BYTES + 1))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    result = collection.update_one(
+        {"_id": _id}, {"$set": {"image": ref}, "$unset": {"picture": ""}}
+    )
+    if not result.matched_count:
+        return jsonify({"error": "Species not found"}), 404
+
+    catalog_cache.invalidate()
+    return jsonify({"image": ref, "url": images.url_for_ref(ref)}), 200
+
+
+@products.get("/images/<ref>")
+def get_image(ref):
+    size = request.args.get("size", type=int)
+    try:
+        path = images.path_for(ref, size)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # O conteúdo nunca muda para a mesma referência
+        response = send_file(
+            path, mimetype=images.mimetype_for(ref, size), max_age=31536000
+        )
+    except FileNotFoundError:
+        return jsonify({"error": "Image not found"}), 404
+
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@products.route("/batch", methods=["GET", "POST"])
+def get_species_batch():
+    """Resolve vários ids de uma vez, na ordem pedida; ids não encontrados voltam como null."""
+    if request.method == "POST":
+        ids = (request.get_json(silent=True) or {}).get("ids")
+    else:
+        ids = request.args.get("ids", "").split(",")
+
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        return jsonify({"error": "Expected 'ids' as a list of strings"}), 400
+    ids = [i.strip() for i in ids if i.strip()]
+    if len(ids) > BATCH_MAX_IDS:
+        return jsonify({"error": f"At most {BATCH_MAX_IDS} ids per request"}), 400
+
+    found = {}
+    for id in set(ids):
+        if (entry := catalog_cache.get(("id", id))) is not None:
+            found[id] = entry.data
+
+    pending = [ObjectId(i) for i in set(ids) - found.keys() if ObjectId.is_valid(i)]
+    if pending:
+        for doc in collection.find({"_id": {"$in": pending}}):
+            entry = freeze(to_dict(doc))
+            catalog_cache.set(("id", doc["_id"]), entry)
+            found[doc["_id"]] = entry.data
+
+    return jsonify(
+        {
+            "match": [found.get(i) for i in ids],
+            "missing": [i for i in ids if i not in found],
+        }
+    )
+
+
 @products.get("/<id>")
 def get_species_by_id(id):
-    species = collection.find_one({"_id": ObjectId(id)})
+    species = catalog_cache.get_or_set(("id", id), lambda: find_species(id))
     if species is None:
         return jsonify({"error": "Species not found"}), 404
 
-    return (jsonify(to_dict(species)), 200)
+    return conditional_response(species)
 
 
 @products.put("/<id>")
@@ -47,6 +273,11 @@ def update_species(id):
     updated_species = request.json
     result = collection.update_one({"_id": ObjectId(id)}, {"$set": updated_species})
     if result.matched_count:
+        if search_index.ready:
+            search_index.add(
+                collection.find_one({"_id": ObjectId(id)}, SearchIndex.PROJECTION)
+            )
+        catalog_cache.invalidate()
         return jsonify({"message": "Species updated"}), 200
     return jsonify({"error": "Species not found"}), 404
 
@@ -55,29 +286,99 @@ def update_species(id):
 def delete_species(id):
     result = collection.delete_one({"_id": ObjectId(id)})
     if result.deleted_count:
+        search_index.remove(id)
+        catalog_cache.invalidate()
         return jsonify({"message": "Species deleted"}), 200
     return jsonify({"error": "Species not found"}), 404
 
 
 @products.get("/busca/<query>")
 def get_itens_by_query(query):
-    itens = [
-        {**doc, "_id": str(doc["_id"])}
-        for doc in collection.find(
-            {
-                "$or": [
-                    {field: {"$regex": query}}
-                    for field in ["name", "scientificName", "tags"]
-                ]
-            },
-        )
-    ]
+    """Busca ranqueada por relevância.
+
+    Retorna a lista de espécies, como antes; com `page` (e `count`) retorna
+    só aquela página em `{"match": [...], "page_count": n}`.
+    """
+    paginated = "page" in request.args
+    # Com type=int, valores que não são inteiros viram None
+    count = request.args.get("count", type=int) if "count" in request.args else 20
+    page = request.args.get("page", type=int) if paginated else 1
+    if count is None or page is None or count <= 0 or page <= 0:
+        return jsonify({"error": "Invalid 'page' or 'count' value"}), 400
+
+    try:
+        projection = list_projection()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def search():
+        ranked = search_index.search(query)
+        if paginated:
+            ranked_page = ranked[count * (page - 1) : count * page]
+        else:
+            ranked_page = ranked
+        page_ids = [ObjectId(i) for i in ranked_page]
+
+        docs = {
+            d["_id"]: d
+            for d in collection.find({"_id": {"$in": page_ids}}, projection)
+        }
+        itens = [to_dict(docs[i]) for i in page_ids if i in docs]
+
+        if not paginated:
+            return freeze(itens)
+        return freeze({"match": itens, "page_count": ceil(len(ranked) / count)})
+
+    return conditional_response(
+        catalog_cache.get_or_set(args_key("busca", query), search)
+    )
+
+
+def cached_count(final_filter):
+    key = ("count", json.dumps(final_filter, sort_keys=True, default=str))
+    return catalog_cache.get_or_set(
+        key, lambda: collection.count_documents(final_filter)
+    )
+
+
+def paginate_by_cursor(final_filter, sort_criteria, count, projection):
+    """Paginação por chave: busca a partir da última chave vista em vez de usar skip."""
+    field, direction = (sort_criteria or [("_id", pymongo.ASCENDING)])[0]
+    conditions = [final_filter] if final_filter else []
+
+    if token := request.args.get("cursor"):
+        cursor_field, cursor_direction, value, last_id = decode_cursor(token)
+        if (cursor_field, cursor_direction) != (field, direction):
+            raise ValueError("Cursor does not match the ordering")
+
+        conditions.append(seek_filter(field, direction, value, last_id))
 
-    return jsonify(itens)
+    keys = [(field, direction)]
+    if field != "_id":
+        keys.append(("_id", direction))
+
+    query = {"$and": conditions} if conditions else {}
+    projection = {**projection, field: 1}
+    docs = list(collection.find(query, projection).sort(keys).limit(count + 1))
+
+    next_cursor = None
+    if len(docs) > count:
+        docs = docs[:count]
+        next_cursor = encode_cursor(field, direction, docs[-1])
+
+    response = {"match": [to_dict(doc) for doc in docs], "next": next_cursor}
+    if request.args.get("total"):
+        response["page_count"] = ceil(cached_count(final_filter) / count)
+
+    return response
 
 
 @products.get("/filtros")
 def get_itens_by_filter():
+    key = args_key("filtros")
+    if (cached := catalog_cache.get(key)) is not None:
+        return conditional_response(cached)
+
     name = request.args.get("name", "")
     tags = request.args.get("tags")
     lancamento = request.args.get("lancamento")
@@ -159,35 +460,89 @@ def get_itens_by_filter():
         sort_criteria = [("_id", pymongo.ASCENDING)]
 
     count = int(request.args.get("count", 20))
-    page = int(request.args.get("page", 1))
 
-    query = collection.find(final_filter).sort(sort_criteria)
-    total = collection.count_documents(final_filter)
+    try:
+        projection = list_projection()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if "cursor" in request.args:
+        try:
+            response = paginate_by_cursor(
+                final_filter, sort_criteria, count, projection
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        page = int(request.args.get("page", 1))
+
+        query = collection.find(final_filter, projection).sort(sort_criteria)
+        total = cached_count(final_filter)
 
-    itens = [to_dict(doc) for doc in query.skip(count * (page - 1)).limit(count)]
+        itens = [to_dict(doc) for doc in query.skip(count * (page - 1)).limit(count)]
+        response = {"match": itens, "page_count": ceil(total / count)}
+
+    entry = freeze(response)
+    catalog_cache.set(key, entry)
+    return conditional_response(entry)
 
-    return jsonify({"match": itens, "page_count": ceil(total / count)})
 
 @products.get("/getotal")
 def get_total():
+    """Unidades vendidas de `product_id`, ou de cada id em `product_ids=a,b,c`."""
+    raw_ids = request.args.get("product_ids")
     product_id = request.args.get("product_id")
-    if not product_id:
+    if not raw_ids and not product_id:
         return jsonify({"error": "Product ID is required"}), 400
 
     try:
-        product_id = ObjectId(product_id)
+        ids = [ObjectId(i) for i in (raw_ids or product_id).split(",")]
     except Exception:
         return jsonify({"error": "Invalid Product ID format"}), 400
 
-    pipeline = [
-        {"$unwind": "$items"},
-        {"$match": {"items._id": product_id, "status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$items.qty"}}} 
-    ]
+    totals = sold.get_many(ids)
 
-    total_sold = list(orders_collection.aggregate(pipeline))
+    if raw_ids:
+        return jsonify({"totals": {str(i): totals.get(i, 0) for i in ids}}), 200
+    return jsonify({"total_sold": totals.get(ids[0], 0)}), 200
 
-    if total_sold:
-        return jsonify({"total_sold": total_sold[0]["total"]}), 200
-    else:
-        return jsonify({"total_sold": 0}), 200
\ No newline at end of file
+
+@products.get("/cache/stats")
+def get_cache_stats():
+    return jsonify(catalog_cache.stats()), 200
+
+
+@products.cli.command("create-indexes")
+def create_indexes():
+    """Cria os índices usados pela paginação por cursor."""
+    for field in ["name", "price"]:
+        print(collection.create_index([(field, 1), ("_id", 1)]))
+
+
+@products.cli.command("rebuild-sold")
+def rebuild_sold():
+    """Recalcula os contadores de unidades vendidas a partir dos pedidos."""
+    sold.rebuild()
+    print(f"{sold.COLLECTION.count_documents({})} species counted")
+
+
+@products.cli.command("import-pictures")
+def import_pictures():
+    """Move as imagens embutidas (data URIs) das espécies para o armazenamento de imagens."""
+    moved = 0
+    for species in collection.find({"picture": {"$regex": "^data:"}}, {"picture": 1}):
+        try:
+            data = base64.b64decode(species["picture"].split(",", 1)[1])
+            ref = images.store(data)
+        except (IndexError, binascii.Error, ValueError) as e:
+            print(f"{species['_id']}: {e}")
+            continue
+
+        collection.update_one(
+            {"_id": species["_id"]},
+            {"$set": {"image": ref}, "$unset": {"picture": ""}},
+        )
+        moved += 1
+
+    catalog_cache.invalidate()
+    print(f"{moved} pictures moved")
\ No newline at end of file
@@ -0,0 +1,18 @@
+from typing import Optional
+
+
+def parse_fields(
+    value: Optional[str], allowed: set[str], default: list[str]
+) -> dict[str, int]:
+    """Converte o parâmetro `fields=a,b,c` numa projeção do MongoDB.
+
+    Sem o parâmetro, usa a projeção `default`. Lança ValueError se algum campo
+    não estiver em `allowed`. O `_id` é sempre incluído pelo próprio Mongo.
+    """
+    fields = [f.strip() for f in value.split(",") if f.strip()] if value else default
+
+    invalid = [f for f in fields if f not in allowed]
+    if invalid:
+        raise ValueError(f"Invalid fields: {', '.join(invalid)}")
+
+    return {field: 1 for field in fields}
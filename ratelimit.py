@@ -0,0 +1,98 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+
+
+class TokenBucket:
+    """Balde de fichas: comporta `burst` fichas e repõe `rate` fichas por segundo.
+
+    Por padrão os baldes ficam na memória do worker (LRU com até `maxsize`
+    chaves). Com `collection`, ficam no MongoDB e são compartilhados entre
+    os workers, ao custo de uma ida ao banco por verificação.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        collection: Optional[Collection] = None,
+        maxsize: int = 65536,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.collection = collection
+        self.maxsize = maxsize
+
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key: str) -> float:
+        """Gasta uma ficha de `key`. Retorna 0, ou os segundos até haver ficha."""
+        if self.collection is not None:
+            return self._consume_shared(key)
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+
+        return wait
+
+    def _consume_shared(self, key: str) -> float:
+        # Reposição e consumo numa única atualização atômica
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$at", now]}]}, 1000]}
+        refilled = {
+            "$min": [
+                self.burst,
+                {
+                    "$add": [
+                        {"$ifNull": ["$tokens", self.burst]},
+                        {"$multiply": [elapsed, self.rate]},
+                    ]
+                },
+            ]
+        }
+        bucket = self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "at": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {
+                    "$set": {
+                        "tokens": {
+                            "$cond": [
+                                "$allowed",
+                                {"$subtract": ["$tokens", 1]},
+                                "$tokens",
+                            ]
+                        },
+                        "expires_at": now + timedelta(seconds=self.burst / self.rate),
+                    }
+                },
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return 0.0 if bucket["allowed"] else (1 - bucket["tokens"]) / self.rate
+
+
+def retry_after(wait: float) -> str:
+    return str(max(1, math.ceil(wait)))
@@ -0,0 +1,137 @@
+import csv
+import json
+from collections import deque
+from datetime import datetime, timedelta
+from io import StringIO
+from os import environ
+from typing import Any, Iterable, Iterator, Optional
+
+from bson import Decimal128, ObjectId
+
+from connections import db
+
+ORDERS = db["orders"]
+# Última posição exportada por consumidor:
+# { _id: <consumer>, last_date, seen: [<_id>, ...], updated_at }
+WATERMARKS = db["export_watermarks"]
+
+# A data do pedido é dada pelo servidor antes do commit, então um pedido pode
+# aparecer depois de outros mais novos. O export incremental relê essa janela
+# antes da marca d'água e descarta os `_id` já enviados (`seen`).
+EXPORT_OVERLAP = timedelta(seconds=int(environ.get("EXPORT_OVERLAP", 5 * 60)))
+
+CSV_COLUMNS = [
+    "_id",
+    "date",
+    "status",
+    "payment_method",
+    "payment_provider",
+    "shipping_provider",
+    "customer_id",
+    "customer_name",
+    "customer_email",
+    "subtotal",
+    "tax",
+    "shipping",
+    "total",
+    "items",
+]
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+def export_row(order: dict[str, Any]) -> dict[str, Any]:
+    """Pedido bruto em tipos JSON; valores monetários viram strings decimais exatas."""
+    return _plain(order)
+
+
+def csv_row(order: dict[str, Any]) -> list[Any]:
+    row = export_row(order)
+    customer = row.get("customer") or {}
+    values = {
+        **row,
+        "customer_name": customer.get("name"),
+        "customer_email": customer.get("email"),
+        "items": json.dumps(row.get("items", []), separators=(",", ":")),
+    }
+    return [values.get(column) for column in CSV_COLUMNS]
+
+
+def get_watermark(consumer: str) -> Optional[dict[str, Any]]:
+    return WATERMARKS.find_one({"_id": consumer, "last_date": {"$exists": True}})
+
+
+def set_watermark(consumer: str, last_date: datetime, seen: list[ObjectId]):
+    WATERMARKS.update_one(
+        {"_id": consumer},
+        {
+            "$set": {
+                "last_date": last_date,
+                "seen": seen,
+                "updated_at": datetime.now(),
+            },
+            "$unset": {"last_id": ""},
+        },
+        upsert=True,
+    )
+
+
+def generate(
+    cursor: Iterable[dict],
+    fmt: str,
+    batch_size: int,
+    consumer: Optional[str] = None,
+    seen: Iterable[ObjectId] = (),
+) -> Iterator[str]:
+    """Gera o export em partes de `batch_size` pedidos, pulando os de `seen`.
+
+    O cursor deve vir ordenado por (`date`, `_id`). Se `consumer` for
+    informado, a marca d'água só avança depois que o último pedido foi
+    enviado, então um export interrompido não perde pedidos.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(CSV_COLUMNS)
+
+    skip = set(seen)
+    # Pedidos dentro da janela de sobreposição, para o próximo export pular
+    recent: deque[tuple[datetime, ObjectId]] = deque()
+    pending = 0
+    for order in cursor:
+        recent.append((order["date"], order["_id"]))
+        while recent[0][0] < order["date"] - EXPORT_OVERLAP:
+            recent.popleft()
+
+        if order["_id"] in skip:
+            continue
+
+        if fmt == "csv":
+            writer.writerow(csv_row(order))
+        else:
+            buffer.write(json.dumps(export_row(order), separators=(",", ":")) + "\n")
+
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+    if consumer and recent:
+        set_watermark(consumer, recent[-1][0], [_id for _, _id in recent])
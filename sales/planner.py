@@ -0,0 +1,50 @@
+from typing import Any, Optional
+
+# Campos presentes no documento bruto do pedido, que podem ser filtrados e
+# ordenados antes do `$lookup` e assim usar os índices da coleção
+RAW_FIELDS = {
+    "_id",
+    "date",
+    "status",
+    "payment_method",
+    "items._id",
+    "total",
+    "customer.name",
+}
+
+
+def plan_filter_pipeline(
+    filters: dict[str, Any],
+    ordering: dict[str, int],
+    skip: int,
+    limit: int,
+    join: list[dict],
+    tail: Optional[list[dict]] = None,
+) -> list[dict]:
+    """Monta o pipeline de filtro de pedidos.
+
+    Predicados sobre campos brutos vão para o início do pipeline. O `join`
+    (lookup e reformatação) só roda antes do filtro quando algum predicado ou
+    ordenação depende de campos calculados por ele; caso contrário, roda apenas
+    sobre a página. Página e total saem de um único `$facet`:
+    `{"match": [...], "count": [{"count": n}]}`.
+    """
+    raw = {k: v for k, v in filters.items() if k in RAW_FIELDS}
+    derived = {k: v for k, v in filters.items() if k not in RAW_FIELDS}
+    join_first = bool(derived) or any(k not in RAW_FIELDS for k in ordering)
+
+    pipeline = [{"$match": raw}] if raw else []
+    page = [{"$skip": skip}, {"$limit": limit}]
+
+    if join_first:
+        pipeline += join
+        if derived:
+            pipeline.append({"$match": derived})
+    else:
+        page += join
+
+    pipeline.append({"$sort": ordering})
+    pipeline.append(
+        {"$facet": {"match": page + (tail or []), "count": [{"$count": "count"}]}}
+    )
+    return pipeline
@@ -0,0 +1,75 @@
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+from os import environ
+from typing import Any
+
+from fpdf import FPDF
+
+REPORT_WORKERS = int(environ.get("REPORT_WORKERS", 2))
+
+
+def render_report(sale: dict[str, Any]) -> bytes:
+    """Gera o PDF de um pedido (saída de BASE_QUERY + LOOKUP_PRODUCTS) em memória."""
+    pdf = FPDF()
+
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+
+    pdf.cell(w=0, h=10, txt=sale["_id"], ln=1, align="L")
+    pdf.cell(w=0, h=10, txt=sale["customer"]["name"], ln=1, align="L")
+    pdf.cell(w=0, h=10, txt=sale["customer"]["email"], ln=1, align="L")
+    pdf.cell(
+        w=0,
+        h=10,
+        txt=f"Enviado via {sale['shipping_provider']} com taxa de R${sale['shipping']}",
+        ln=1,
+        align="L",
+    )
+    pdf.cell(w=0, h=10, txt="Itens comprados", ln=1, align="L")
+
+    header = ["id", "nome", "preço unitário", "quantidade"]
+    names = {str(p["_id"]): p["name"] for p in sale["prods"]}
+    prods = [
+        (item["_id"], names.get(item["_id"], ""), str(item["price"]), str(item["qty"]))
+        for item in sale["items"]
+    ]
+    col_width = [60, 50, 35, 35]
+
+    for i, (h, w) in enumerate(zip(header, col_width)):
+        pdf.cell(
+            w=w, h=8, txt=h, border=1, align="C", ln=int(bool(i == len(header) - 1))
+        )
+
+    for prod in prods:
+        for i, (field, w) in enumerate(zip(prod, col_width)):
+            pdf.cell(
+                w=w,
+                h=8,
+                txt=field,
+                border=1,
+                align="C",
+                # ln=int(bool(i == len(header) - 1)),
+            )
+        pdf.cell(w=0, h=8, txt="", border=0, align="C", ln=1)
+
+    pdf.cell(w=0, h=10, txt=f"Total: R${sale['total']}", ln=1, align="L")
+
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def render_zip(sales: list[dict[str, Any]]) -> BytesIO:
+    """Gera os PDFs em paralelo num pool de processos e os empacota num ZIP em memória."""
+    buffer = BytesIO()
+
+    # "spawn" para que os processos filhos não herdem o cliente do MongoDB
+    with ProcessPoolExecutor(REPORT_WORKERS, mp_context=get_context("spawn")) as pool:
+        pdfs = pool.map(render_report, sales, chunksize=8)
+
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for sale, pdf in zip(sales, pdfs):
+                archive.writestr(f"report__{sale['_id']}.pdf", pdf)
+
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,129 @@
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from hashlib import blake2b
+from typing import Any, Iterable, Optional
+
+from bson import Decimal128
+from pymongo import UpdateOne
+
+from connections import db
+from sales.validation import SaleStatus
+
+# Um documento por dia:
+# { _id: <dia 00:00>, revenue: Decimal128, orders: n,
+#   units: {<species id>: n}, customers: {<chave do cliente>: n} }
+COLLECTION = db["sales_daily"]
+ORDERS = db["orders"]
+
+# Pedidos cancelados ("cancelled" vem de pedidos antigos) ficam fora dos totais
+EXCLUDED_STATUSES = [SaleStatus.CANCELLED.value, "cancelled"]
+
+ORDER_FIELDS = {
+    "date": 1,
+    "status": 1,
+    "subtotal": 1,
+    "items": 1,
+    "customer_id": 1,
+    "customer.email": 1,
+}
+
+
+def day_of(date: datetime) -> datetime:
+    return datetime(date.year, date.month, date.day)
+
+
+def customer_key(order: dict[str, Any]) -> Optional[str]:
+    """Clientes logados pelo id; compradores anônimos pelo hash do e-mail."""
+    if order.get("customer_id"):
+        return f"u:{order['customer_id']}"
+    email = (order.get("customer") or {}).get("email")
+    if email:
+        digest = blake2b(email.strip().lower().encode(), digest_size=8)
+        return f"e:{digest.hexdigest()}"
+    return None
+
+
+def _counts(order: dict[str, Any], sign: int) -> dict[str, Any]:
+    subtotal = order.get("subtotal") or Decimal128("0")
+    counts = defaultdict(int, orders=sign, revenue=sign * subtotal.to_decimal())
+    for item in order.get("items", []):
+        counts[f"units.{item['_id']}"] += sign * item["qty"]
+    if key := customer_key(order):
+        counts[f"customers.{key}"] += sign
+    return counts
+
+
+def _inc(counts: dict[str, Any]) -> dict[str, Any]:
+    return {"$inc": {**counts, "revenue": Decimal128(counts["revenue"])}}
+
+
+def _apply(order: dict[str, Any], sign: int, session=None):
+    COLLECTION.update_one(
+        {"_id": day_of(order["date"])},
+        _inc(_counts(order, sign)),
+        upsert=True,
+        session=session,
+    )
+
+
+def record(order: dict[str, Any], session=None):
+    """Soma um pedido novo aos totais do dia dele, se não estiver cancelado."""
+    if order.get("status") not in EXCLUDED_STATUSES:
+        _apply(order, 1, session)
+
+
+def record_status_change(order: dict[str, Any], old_status, new_status, session=None):
+    """Ajusta os totais quando um pedido é cancelado ou deixa de ser."""
+    was_counted = old_status not in EXCLUDED_STATUSES
+    is_counted = new_status not in EXCLUDED_STATUSES
+    if was_counted != is_counted:
+        _apply(order, 1 if is_counted else -1, session)
+
+
+def rebuild(start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+    """Recalcula os dias em [start, end) a partir dos pedidos e retorna quantos gravou."""
+    days = {}
+    if start is not None:
+        days["$gte"] = day_of(start)
+    if end is not None:
+        days["$lt"] = day_of(end)
+
+    totals = defaultdict(lambda: defaultdict(int))
+    query = {"status": {"$nin": EXCLUDED_STATUSES}}
+    if days:
+        query["date"] = days
+    for order in ORDERS.find(query, ORDER_FIELDS):
+        day = totals[day_of(order["date"])]
+        for field, value in _counts(order, 1).items():
+            day[field] += value
+
+    COLLECTION.delete_many({"_id": days} if days else {})
+    ops = [
+        UpdateOne({"_id": day}, _inc(counts), upsert=True)
+        for day, counts in totals.items()
+    ]
+    if ops:
+        COLLECTION.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def find_days(
+    start: datetime, end: Optional[datetime] = None
+) -> Iterable[dict[str, Any]]:
+    days = {"$gte": start}
+    if end is not None:
+        days["$lt"] = end
+    return COLLECTION.find({"_id": days})
+
+
+def summarize(days: Iterable[dict[str, Any]]) -> dict[str, Any]:
+    """Junta vários dias: receita, pedidos e clientes distintos no período."""
+    revenue = Decimal(0)
+    orders = 0
+    customers = set()
+    for day in days:
+        revenue += day.get("revenue", Decimal128("0")).to_decimal()
+        orders += day.get("orders", 0)
+        customers.update(k for k, n in day.get("customers", {}).items() if n > 0)
+    return {"revenue": revenue, "orders": orders, "customers": len(customers)}
@@ -0,0 +1,50 @@
+from typing import Any
+
+from bson import ObjectId
+
+from connections import db
+
+ORDERS = db["orders"]
+
+# Campos do usuário copiados para `customer` em cada pedido
+SNAPSHOT_FIELDS = ("name", "surname", "email")
+
+
+def refresh_customer_snapshots(user_id: ObjectId, changes: dict[str, Any]):
+    """Propaga alterações de nome, sobrenome e e-mail do usuário para os pedidos."""
+    fields = {f"customer.{k}": v for k, v in changes.items() if k in SNAPSHOT_FIELDS}
+    if fields:
+        ORDERS.update_many({"customer_id": user_id}, {"$set": fields})
+
+
+def backfill_customer_snapshots():
+    """Grava o snapshot do cliente nos pedidos antigos, que só tinham `customer_id`."""
+    ORDERS.aggregate(
+        [
+            {
+                "$match": {
+                    "customer_id": {"$ne": None},
+                    "customer._id": {"$exists": False},
+                }
+            },
+            {
+                "$lookup": {
+                    "from": "users",
+                    "localField": "customer_id",
+                    "foreignField": "_id",
+                    "as": "user",
+                    "pipeline": [{"$project": {f: 1 for f in SNAPSHOT_FIELDS}}],
+                }
+            },
+            {"$match": {"user": {"$ne": []}}},
+            {"$project": {"customer": {"$arrayElemAt": ["$user", 0]}}},
+            {
+                "$merge": {
+                    "into": ORDERS.name,
+                    "on": "_id",
+                    "whenMatched": "merge",
+                    "whenNotMatched": "discard",
+                }
+            },
+        ]
+    )
@@ -1,16 +1,45 @@
 from dataclasses import dataclass
 from datetime import datetime
-from decimal import Inexact, InvalidOperation
+from decimal import Decimal, Inexact, InvalidOperation
 from enum import Enum
+from os import environ
 from typing import Any, Optional, Self
 from bson import Decimal128, ObjectId
 from bson.errors import InvalidId
-from flask import current_app
-import jwt
 
+from cache import TTLCache
 from connections import db
 
-product_collection = db["teste_species"]
+product_collection = db["species"]
+
+# Preço e estoque por espécie, por poucos segundos, para aliviar picos de checkout
+price_cache = TTLCache(
+    maxsize=int(environ.get("PRICE_CACHE_SIZE", 4096)),
+    ttl=float(environ.get("PRICE_CACHE_TTL", 5)),
+)
+
+
+def has_stock(product: dict[str, Any], qty: int) -> bool:
+    """Espécies sem `quantity` não têm estoque controlado e estão sempre disponíveis."""
+    return product.get("quantity", qty) >= qty
+
+
+def resolve_prices(ids: set[ObjectId]) -> dict[ObjectId, dict[str, Any]]:
+    """Busca preço e estoque de todas as espécies com uma única consulta `$in`."""
+    found = {}
+    for _id in ids:
+        if (cached := price_cache.get(_id)) is not None:
+            found[_id] = cached
+
+    pending = list(ids - found.keys())
+    if pending:
+        for doc in product_collection.find(
+            {"_id": {"$in": pending}}, {"price": 1, "quantity": 1}
+        ):
+            price_cache.set(doc["_id"], doc)
+            found[doc["_id"]] = doc
+
+    return found
 
 
 @dataclass
@@ -50,9 +79,32 @@ class AnonymousUser:
         }
 
 
+@dataclass
+class CustomerSnapshot:
+    """Cópia de id, nome, sobrenome e e-mail do cliente logado, gravada no pedido."""
+
+    id: ObjectId
+    name: str
+    email: str
+    surname: Optional[str] = None
+
+    @staticmethod
+    def from_user(user: dict[str, Any]) -> Self:
+        return CustomerSnapshot(
+            user["_id"], user["name"], user["email"], user.get("surname")
+        )
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "_id": self.id,
+            "name": self.name,
+            "surname": self.surname,
+            "email": self.email,
+        }
+
+
 @dataclass
 class SaleItem:
-    # TODO: decrement items available quantity
     id: ObjectId
     price: Decimal128
     qty: int
@@ -60,17 +112,46 @@ class SaleItem:
     _required = ["id", "qty"]
 
     @staticmethod
-    def from_dict(d: dict[str, str | int]) -> Self:
-        for field in SaleItem._required:
-            assert field in d, f"Missing field '{field}' for SaleItem"
+    def from_dicts(items: list[dict[str, str | int]]) -> list[Self]:
+        """Valida o carrinho inteiro, reportando todos os itens com problema de uma vez."""
+        errors = []
+        parsed = []
+        for d in items:
+            missing = [f for f in SaleItem._required if f not in d]
+            if missing:
+                errors.append(f"Missing field '{missing[0]}' for SaleItem")
+                continue
 
-        try:
-            _id = ObjectId(d["id"])
-            _price = product_collection.find_one({"_id": _id})["price"]
-        except InvalidId:
-            raise AssertionError(f"Invalid oid for SaleItem: '{d['id']}'")
+            try:
+                _id = ObjectId(d["id"])
+            except (InvalidId, TypeError):
+                errors.append(f"Invalid oid for SaleItem: '{d['id']}'")
+                continue
+
+            if not isinstance(d["qty"], int) or d["qty"] <= 0:
+                errors.append(f"Invalid qty for SaleItem '{d['id']}': {d['qty']}")
+                continue
 
-        return SaleItem(_id, _price, d["qty"])
+            parsed.append((_id, d["qty"]))
+
+        products = resolve_prices({_id for _id, _ in parsed})
+
+        not_found = [str(_id) for _id, _ in parsed if _id not in products]
+        if not_found:
+            errors.append(f"Products not found: {', '.join(not_found)}")
+
+        unavailable = [
+            str(_id)
+            for _id, qty in parsed
+            if _id in products and not has_stock(products[_id], qty)
+        ]
+        if unavailable:
+            errors.append(f"Products unavailable: {', '.join(unavailable)}")
+
+        if errors:
+            raise AssertionError("; ".join(errors))
+
+        return [SaleItem(_id, products[_id]["price"], qty) for _id, qty in parsed]
 
     # TODO URGENT: ensure item prices are Decimal128
     def to_bson(self) -> dict[str, str | float | Decimal128]:
@@ -106,15 +187,16 @@ class Sale:
     status: SaleStatus
     date: datetime
     payment_provider: Optional[str] = None
-    customer: Optional[AnonymousUser] = None
+    customer: Optional[AnonymousUser | CustomerSnapshot] = None
     customer_id: Optional[ObjectId] = None
 
     @staticmethod
-    def from_dict(d: dict[str, Any], token=None) -> Self:
-        assert d.get("customer") or token, "Missing customer data"
+    def from_dict(d: dict[str, Any], user: Optional[dict[str, Any]] = None) -> Self:
+        """`user` é o usuário autenticado (ver `auth.views.current_identity`), se houver."""
+        assert d.get("customer") or user, "Missing customer data"
 
         assert d.get("items") is not None and len(d["items"]) > 0, "The cart is empty"
-        _items = [SaleItem.from_dict(item) for item in d["items"]]
+        _items = SaleItem.from_dicts(d["items"])
 
         try:
             _tax = Decimal128(str(d.get("tax")))
@@ -137,16 +219,9 @@ class Sale:
         _customer_id = None
         _customer = None
 
-        if token:
-            try:
-                payload = jwt.decode(
-                    token, current_app.config["SECRET_KEY"], algorithms=["HS256"]
-                )
-                _customer_id = ObjectId(payload.get("sub"))
-            except jwt.DecodeError:
-                raise AssertionError("Invalid auth token")
-            except InvalidId:
-                raise AssertionError("Invalid oid in auth token")
+        if user:
+            _customer_id = user["_id"]
+            _customer = CustomerSnapshot.from_user(user)
         else:
             # TODO: avoid anonymous purchases from using existing e-mails
             _customer = AnonymousUser.from_dict(d.get("customer"))
@@ -165,11 +240,21 @@ class Sale:
             _customer_id,
         )
 
+    def subtotal(self) -> Decimal:
+        return sum(
+            (item.price.to_decimal() * item.qty for item in self.items), Decimal(0)
+        )
+
+    def total(self) -> Decimal:
+        return self.subtotal() + self.tax.to_decimal() + self.shipping.to_decimal()
+
     def to_bson(self) -> dict[str, Any]:
         return {
             "items": [item.to_bson() for item in self.items],
             "tax": self.tax,
             "shipping": self.shipping,
+            "subtotal": Decimal128(self.subtotal()),
+            "total": Decimal128(self.total()),
             "shipping_provider": self.shipping_provider,
             "payment_method": self.payment_method.value,
             "status": self.status.value,
@@ -1,15 +1,36 @@
 from collections import defaultdict
-from datetime import datetime
+from datetime import datetime, timedelta
 from math import ceil
-import time
-
-from bson import ObjectId, Regex
-from flask import Blueprint, jsonify, request, send_file
-from fpdf import FPDF
+from os import environ
+
+from bson import ObjectId
+from bson.errors import InvalidId
+import click
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
 import pymongo
-
-from connections import db
-from sales.validation import Sale
+from pymongo.errors import PyMongoError
+
+from auth.views import AuthError, current_identity, login_required
+from connections import client, db
+from jobs.runner import JobResult
+from jobs.views import enqueue_job
+from products import sold
+from products.views import catalog_cache
+from projection import parse_fields
+from sales import export, rollup
+from sales.planner import plan_filter_pipeline
+from sales.reports import render_report, render_zip
+from sales.snapshots import backfill_customer_snapshots
+from sales.validation import Sale, SaleStatus, has_stock
+from streaming import batch_size, stream_response
+from textmatch import CASE_INSENSITIVE, match_mode, text_filter
 from datetime import datetime
 
 sales = Blueprint("sales", __name__)
@@ -17,25 +38,28 @@ COLLECTION = db["orders"]
 CUSTOMERS = db["users"]
 PRODUCTS = db["species"]
 
+REPORT_BATCH_MAX = int(environ.get("REPORT_BATCH_MAX", 1000))
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
 
+# `customer` é o snapshot {_id, name, email} do usuário logado ou os dados do
+# comprador anônimo, ambos gravados no próprio pedido
 BASE_QUERY = [
-    {
-        "$lookup": {
-            "from": "users",
-            "localField": "customer_id",
-            "foreignField": "_id",
-            "as": "user",
-            "pipeline": [
-                {"$project": {"name": 1, "email": 1}},
-                {"$set": {"_id": {"$toString": "$_id"}}},
-            ],
-        }
-    },
     {"$unset": ["customer_id"]},
     {
         "$set": {
-            "temp": "$customer",
-            "customer": {"$arrayElemAt": ["$user", 0]},
+            "customer": {
+                "$cond": [
+                    {"$ifNull": ["$customer._id", False]},
+                    {
+                        "$mergeObjects": [
+                            "$customer",
+                            {"_id": {"$toString": "$customer._id"}},
+                        ]
+                    },
+                    "$customer",
+                ]
+            },
             "items": {
                 "$map": {
                     "input": "$items",
@@ -51,29 +75,28 @@ BASE_QUERY = [
             "tax": {"$toDouble": "$tax"},
             "shipping": {"$toDouble": "$shipping"},
             "_id": {"$toString": "$_id"},
-            "total": {
-                "$toDouble": {
-                    "$sum": [
-                        {
-                            "$sum": {
-                                "$map": {
-                                    "input": "$items",
-                                    "as": "item",
-                                    "in": {"$multiply": ["$$item.price", "$$item.qty"]},
-                                }
-                            }
-                        },
-                        {"$toDouble": "$tax"},
-                        {"$toDouble": "$shipping"},
-                    ]
-                }
-            },
+            "subtotal": {"$toDouble": "$subtotal"},
+            "total": {"$toDouble": "$total"},
         }
     },
-    {"$set": {"customer": {"$ifNull": ["$customer", "$temp", "$customer"]}}},
-    {"$unset": ["temp", "user"]},
 ]
 
+ORDER_FIELDS = {
+    "items",
+    "tax",
+    "shipping",
+    "shipping_provider",
+    "payment_method",
+    "payment_provider",
+    "status",
+    "date",
+    "customer",
+    "subtotal",
+    "total",
+}
+# Projeção das listagens quando `fields` não é informado
+LIST_FIELDS = ["customer", "date", "status", "payment_method", "total"]
+
 LOOKUP_PRODUCTS = [
     {
         "$lookup": {
@@ -86,30 +109,161 @@ LOOKUP_PRODUCTS = [
 ]
 
 
+def list_projection():
+    return parse_fields(request.args.get("fields"), ORDER_FIELDS, LIST_FIELDS)
+
+
 @sales.get("/")
 def get_all_orders():
-    query = COLLECTION.aggregate(BASE_QUERY)
-    return jsonify(list(query))
+    try:
+        projection = list_projection()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    pipeline = BASE_QUERY + [{"$project": projection}]
+
+    if "stream" in request.args:
+        return stream_response(
+            lambda size: COLLECTION.aggregate(pipeline, batchSize=size),
+            error_key="message",
+        )
+
+    return jsonify(list(COLLECTION.aggregate(pipeline)))
+
+
+class OutOfStockError(Exception):
+    pass
+
+
+def reserve_stock(sale: Sale, session):
+    """Baixa o estoque de todos os itens numa única ida ao banco, só se houver estoque.
+
+    Espécies sem `quantity` não têm estoque controlado (ver `has_stock`): são
+    aceitas e continuam sem o campo.
+    """
+    quantities = defaultdict(int)
+    for prod in sale.items:
+        quantities[prod.id] += prod.qty
+
+    # Para cada espécie, no máximo um dos dois filtros casa: baixa o estoque
+    # controlado, ou só confirma (sem alterar) o estoque não controlado
+    writes = []
+    for _id, qty in quantities.items():
+        writes.append(
+            pymongo.UpdateOne(
+                {"_id": _id, "quantity": {"$gte": qty}}, {"$inc": {"quantity": -qty}}
+            )
+        )
+        writes.append(
+            pymongo.UpdateOne(
+                {"_id": _id, "quantity": {"$exists": False}},
+                {"$unset": {"quantity": ""}},
+            )
+        )
+
+    result = PRODUCTS.bulk_write(writes, ordered=False, session=session)
+
+    if result.matched_count != len(quantities):
+        found = {
+            doc["_id"]: doc
+            for doc in PRODUCTS.find(
+                {"_id": {"$in": list(quantities)}}, {"quantity": 1}, session=session
+            )
+        }
+        short = [
+            str(i)
+            for i, qty in quantities.items()
+            if i not in found or not has_stock(found[i], qty)
+        ]
+        raise OutOfStockError(f"Insufficient stock for: {', '.join(short)}")
 
 
 @sales.post("/new")
 def register_sale():
     body = request.get_json()
 
+    user = None
+    if "Authorization" in request.headers:
+        try:
+            user = current_identity().user
+        except AuthError as e:
+            return e.response()
+
     try:
-        sale: Sale = Sale.from_dict(body, request.headers.get("Authorization"))
+        sale: Sale = Sale.from_dict(body, user)
     except (AssertionError, ValueError) as e:
         return jsonify({"message": str(e)}), 400
 
-    _id = COLLECTION.insert_one(sale.to_bson()).inserted_id
+    # Pedido e estoque são gravados juntos ou nada é gravado
+    def place_order(session):
+        order = sale.to_bson()
+        COLLECTION.insert_one(order, session=session)
+        reserve_stock(sale, session)
+        return order
 
-    sale.items
+    try:
+        with client.start_session() as session:
+            order = session.with_transaction(place_order)
+    except OutOfStockError as e:
+        return jsonify({"message": str(e)}), 409
+
+    # O catálogo em cache mostra `quantity`, que acabou de mudar
+    catalog_cache.invalidate()
+
+    # Os contadores derivados ficam fora da transação: todos os pedidos do dia
+    # incrementam o mesmo documento, e lá dentro os checkouts concorrentes
+    # abortariam uns aos outros. Se falharem, `flask sales rebuild-daily` e
+    # `flask products rebuild-sold` os recalculam.
+    try:
+        if sale.status.value in sold.SOLD_STATUSES:
+            sold.record((prod.id, prod.qty) for prod in sale.items)
+        rollup.record(order)
+    except PyMongoError:
+        current_app.logger.exception("Counters not updated for order %s", order["_id"])
 
-    for prod in sale.items:
-        res = PRODUCTS.update_one({"_id": prod.id}, {"$inc": {"quantity": -prod.qty}})
-        print(res)
+    return jsonify({"message": "Success", "inserted_id": str(order["_id"])}), 200
+
+
+STATUS_ROLES = {"admin", "staff"}
+
+
+@sales.patch("/<id>/status")
+@login_required
+def update_status(payload, id):
+    if current_identity().user.get("role") not in STATUS_ROLES:
+        return jsonify({"message": "Forbidden"}), 403
+
+    try:
+        _id = ObjectId(id)
+    except InvalidId:
+        return jsonify({"message": "Invalid id"}), 400
+
+    body = request.get_json(silent=True)
+    try:
+        status = SaleStatus(body.get("status") if isinstance(body, dict) else None)
+    except ValueError:
+        return jsonify({"message": "Invalid 'status' value"}), 400
+
+    # Status e contadores mudam juntos ou nada muda
+    def change_status(session):
+        previous = COLLECTION.find_one_and_update(
+            {"_id": _id},
+            {"$set": {"status": status.value}},
+            projection=rollup.ORDER_FIELDS,
+            session=session,
+        )
+        if previous is not None:
+            old = previous["status"]
+            sold.record_status_change(previous["items"], old, status.value, session)
+            rollup.record_status_change(previous, old, status.value, session)
+        return previous
+
+    with client.start_session() as session:
+        previous = session.with_transaction(change_status)
+    if previous is None:
+        return jsonify({"message": "Order not found"}), 404
 
-    return jsonify({"message": "Success", "inserted_id": str(_id)}), 200
+    return jsonify({"message": "Status updated"}), 200
 
 
 def parse_date(date_str):
@@ -131,11 +285,15 @@ def filter_sales():
     filters = defaultdict(dict)
     ordering = {}
 
-    if "username" in body:
-        filters["customer.name"] = {"$regex": Regex(body["username"], "i")}
+    try:
+        match = match_mode(body)
+        if "username" in body:
+            filters["customer.name"] = text_filter(body["username"], match)
 
-    if "payment_method" in body:
-        filters["payment_method"] = {"$regex": Regex(body["payment_method"], "i")}
+        if "payment_method" in body:
+            filters["payment_method"] = text_filter(body["payment_method"], match)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
 
     if "status" in body:
         try:
@@ -150,7 +308,12 @@ def filter_sales():
         filters["total"]["$lte"] = float(body["max_price"])
 
     if "products" in body:
-        filters["items._id"] = {"$in": body["products"].split(",")}
+        try:
+            filters["items._id"] = {
+                "$in": [ObjectId(i) for i in body["products"].split(",")]
+            }
+        except InvalidId:
+            return jsonify({"message": "Invalid 'products' value"}), 400
 
     if "min_date" in body:
         try:
@@ -178,35 +341,117 @@ def filter_sales():
     if not ordering:
         ordering["_id"] = pymongo.ASCENDING
 
+    try:
+        projection = list_projection()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
     count = int(body.get("count", 20))
     page = int(body.get("page", 1))
-    pagination = [{"$skip": count * (page - 1)}, {"$limit": count}]
-
-    query = COLLECTION.aggregate(
-        BASE_QUERY + [{"$match": filters}, {"$sort": ordering}] + pagination
-    )
 
-    full_count_result = COLLECTION.aggregate(
-        BASE_QUERY
-        + [
-            {"$match": filters},
-            {"$sort": ordering},
-            {"$group": {"_id": None, "count": {"$sum": 1}}},
-        ]
+    pipeline = plan_filter_pipeline(
+        filters,
+        ordering,
+        skip=count * (page - 1),
+        limit=count,
+        join=BASE_QUERY,
+        tail=[{"$project": projection}],
     )
+    result = next(COLLECTION.aggregate(pipeline, collation=CASE_INSENSITIVE))
 
-    full_count = 0
-    for result in full_count_result:
-        full_count = result.get(
-            "count", 0
-        )  # Usar 0 como valor padrão caso 'count' não exista
+    full_count = result["count"][0]["count"] if result["count"] else 0
 
     # Se não houver nenhum resultado, a contagem de páginas deve ser zero
     if full_count == 0:
         return jsonify({"match": [], "page_count": 0})
 
     # Retornar o número total de páginas
-    return jsonify({"match": list(query), "page_count": ceil(full_count / count)})
+    return jsonify({"match": result["match"], "page_count": ceil(full_count / count)})
+
+
+@sales.get("/export")
+def export_orders():
+    """Exporta pedidos brutos em NDJSON ou CSV, em ordem de (`date`, `_id`).
+
+    - `min_date`/`max_date` limitam a janela de datas, inclusive, como em `/filter`;
+    - `after=<_id>` retoma um export interrompido a partir da última linha recebida;
+    - `consumer=<nome>` grava a posição final quando o export termina, e
+      `since=last` começa de onde o último export completo desse consumidor parou,
+      relendo os últimos EXPORT_OVERLAP e pulando os pedidos já enviados.
+    """
+    body = request.args
+
+    fmt = body.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"message": f"Invalid format '{fmt}'"}), 400
+
+    try:
+        size = batch_size()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    query = defaultdict(dict)
+    try:
+        if "min_date" in body:
+            query["date"]["$gte"] = parse_date(body["min_date"])
+        if "max_date" in body:
+            query["date"]["$lte"] = parse_date(body["max_date"])
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    consumer = body.get("consumer")
+    seen = []
+    if "after" in body:
+        try:
+            after = COLLECTION.find_one({"_id": ObjectId(body["after"])}, {"date": 1})
+        except InvalidId:
+            after = None
+        if after is None:
+            return jsonify({"message": "Invalid 'after' value"}), 400
+        query["$or"] = [
+            {"date": {"$gt": after["date"]}},
+            {"date": after["date"], "_id": {"$gt": after["_id"]}},
+        ]
+    elif body.get("since") == "last":
+        if not consumer:
+            return jsonify({"message": "'since=last' requires 'consumer'"}), 400
+        watermark = export.get_watermark(consumer)
+        if watermark is not None:
+            since = watermark["last_date"] - export.EXPORT_OVERLAP
+            query["date"]["$gte"] = max(query["date"].get("$gte", since), since)
+            seen = watermark["seen"]
+
+    cursor = (
+        COLLECTION.find(query)
+        .sort([("date", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+        .batch_size(size)
+    )
+
+    return Response(
+        stream_with_context(export.generate(cursor, fmt, size, consumer, seen)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename=orders.{fmt}"},
+    )
+
+
+def build_report(sale):
+    return JobResult(
+        render_report(sale),
+        mimetype="application/pdf",
+        download_name=f"report__{sale['_id']}.pdf",
+    )
+
+
+def build_report_batch(match):
+    # Os pedidos são carregados dentro da tarefa, fora da requisição
+    sales = COLLECTION.aggregate(
+        [{"$match": match}, {"$sort": {"_id": 1}}] + LOOKUP_PRODUCTS + BASE_QUERY
+    )
+    return JobResult(
+        render_zip(list(sales)).getvalue(),
+        mimetype="application/zip",
+        download_name="reports.zip",
+    )
 
 
 @sales.get("/report/<id>")
@@ -214,51 +459,115 @@ def get_report(id):
     sales = COLLECTION.aggregate(
         [{"$match": {"_id": ObjectId(id)}}] + LOOKUP_PRODUCTS + BASE_QUERY
     )
-    sale = list(sales)[0]
-    pdf = FPDF()
-
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-
-    pdf.cell(w=0, h=10, txt=sale["_id"], ln=1, align="L")
-    pdf.cell(w=0, h=10, txt=sale["customer"]["name"], ln=1, align="L")
-    pdf.cell(w=0, h=10, txt=sale["customer"]["email"], ln=1, align="L")
-    pdf.cell(
-        w=0,
-        h=10,
-        txt=f"Enviado via {sale['shipping_provider']} com taxa de R${sale['shipping']}",
-        ln=1,
-        align="L",
+    sale = next(sales, None)
+    if sale is None:
+        return jsonify({"message": "Order not found"}), 404
+
+    return enqueue_job("sales.report", build_report, sale)
+
+
+@sales.post("/report/batch")
+def get_reports_batch():
+    """Relatórios de vários pedidos num ZIP, por lista de `ids` ou por `min_date`/`max_date`."""
+    body = request.get_json(silent=True) or {}
+
+    if "ids" in body:
+        try:
+            match = {"_id": {"$in": [ObjectId(i) for i in body["ids"]]}}
+        except (InvalidId, TypeError):
+            return jsonify({"message": "Invalid 'ids' value"}), 400
+    elif "min_date" in body or "max_date" in body:
+        match = {"date": {}}
+        try:
+            if "min_date" in body:
+                match["date"]["$gte"] = parse_date(str(body["min_date"]))
+            if "max_date" in body:
+                match["date"]["$lte"] = parse_date(str(body["max_date"]))
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+    else:
+        return jsonify({"message": "Expected 'ids' or 'min_date'/'max_date'"}), 400
+
+    found = COLLECTION.count_documents(match, limit=REPORT_BATCH_MAX + 1)
+    if found > REPORT_BATCH_MAX:
+        return jsonify({"message": f"At most {REPORT_BATCH_MAX} reports per batch"}), 400
+    if not found:
+        return jsonify({"message": "No orders found"}), 404
+
+    return enqueue_job("sales.report_batch", build_report_batch, match)
+
+
+@sales.cli.command("backfill-totals")
+def backfill_totals():
+    """Grava subtotal e total nos pedidos antigos, que não tinham esses campos."""
+    result = COLLECTION.update_many(
+        {"total": {"$exists": False}},
+        [
+            {
+                "$set": {
+                    "subtotal": {
+                        "$sum": {
+                            "$map": {
+                                "input": {"$ifNull": ["$items", []]},
+                                "as": "item",
+                                "in": {
+                                    "$multiply": [
+                                        {"$toDecimal": "$$item.price"},
+                                        "$$item.qty",
+                                    ]
+                                },
+                            }
+                        }
+                    }
+                }
+            },
+            {
+                "$set": {
+                    "subtotal": {"$toDecimal": "$subtotal"},
+                    "total": {
+                        "$add": [
+                            {"$toDecimal": "$subtotal"},
+                            {"$toDecimal": {"$ifNull": ["$tax", 0]}},
+                            {"$toDecimal": {"$ifNull": ["$shipping", 0]}},
+                        ]
+                    },
+                }
+            },
+        ],
     )
-    pdf.cell(w=0, h=10, txt="Itens comprados", ln=1, align="L")
-
-    header = ["id", "nome", "preço unitário", "quantidade"]
-    prods = [
-        (item["_id"], p["name"], str(item["price"]), str(item["qty"]))
-        for item, p in zip(sale["items"], sale["prods"])
-    ]
-    col_width = [60, 50, 35, 35]
-
-    for i, (h, w) in enumerate(zip(header, col_width)):
-        pdf.cell(
-            w=w, h=8, txt=h, border=1, align="C", ln=int(bool(i == len(header) - 1))
-        )
+    print(f"{result.modified_count} orders updated")
+
+
+@sales.cli.command("create-indexes")
+def create_indexes():
+    """Cria os índices usados pelos filtros e ordenações de pedidos."""
+    for keys in ["date", "total", "customer_id"]:
+        print(COLLECTION.create_index(keys))
 
-    for prod in prods:
-        for i, (field, w) in enumerate(zip(prod, col_width)):
-            pdf.cell(
-                w=w,
-                h=8,
-                txt=field,
-                border=1,
-                align="C",
-                # ln=int(bool(i == len(header) - 1)),
+    # Ordem do export incremental
+    print(COLLECTION.create_index([("date", 1), ("_id", 1)]))
+
+    # Filtros de texto e ordenação por nome rodam com CASE_INSENSITIVE
+    for field in ["customer.name", "payment_method"]:
+        print(
+            COLLECTION.create_index(
+                field, name=f"{field}_ci", collation=CASE_INSENSITIVE
             )
-        pdf.cell(w=0, h=8, txt="", border=0, align="C", ln=1)
+        )
+
 
-    pdf.cell(w=0, h=10, txt=f"Total: R${sale['total']}", ln=1, align="L")
+@sales.cli.command("backfill-customers")
+def backfill_customers():
+    """Grava o snapshot do cliente nos pedidos antigos de usuários logados."""
+    backfill_customer_snapshots()
+    total = COLLECTION.count_documents({"customer._id": {"$exists": True}})
+    print(f"{total} orders with a customer snapshot")
 
-    file_name = f"report__{time.time()}.pdf"
 
-    pdf.output(file_name)
-    return send_file(file_name, mimetype="application/pdf", as_attachment=True)
+@sales.cli.command("rebuild-daily")
+@click.option("--start", type=click.DateTime(["%Y-%m-%d"]), help="Primeiro dia")
+@click.option("--end", type=click.DateTime(["%Y-%m-%d"]), help="Último dia, incluso")
+def rebuild_daily(start, end):
+    """Recalcula os totais diários (sales_daily) no intervalo, ou de todo o histórico."""
+    days = rollup.rebuild(start, end and end + timedelta(days=1))
+    print(f"{days} days rebuilt")
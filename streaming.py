@@ -0,0 +1,66 @@
+from os import environ
+from typing import Any, Callable, Iterable
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+
+STREAM_FORMATS = {"json": "application/json", "ndjson": "application/x-ndjson"}
+STREAM_BATCH_SIZE = int(environ.get("STREAM_BATCH_SIZE", 500))
+
+
+def batch_size() -> int:
+    """Lê `batch_size` da query string. Lança ValueError se não for um inteiro positivo."""
+    try:
+        size = int(request.args.get("batch_size", STREAM_BATCH_SIZE))
+    except ValueError:
+        size = 0
+    if size < 1:
+        raise ValueError("Invalid 'batch_size' value")
+    return size
+
+
+def stream_response(
+    open_cursor: Callable[[int], Iterable[dict]],
+    transform: Callable[[dict], Any] = lambda doc: doc,
+    error_key: str = "error",
+) -> Response:
+    """Envia o cursor em partes, como array JSON (`stream=json`) ou NDJSON (`stream=ndjson`).
+
+    Os parâmetros são validados antes de `open_cursor(batch_size)` ser chamado,
+    então uma requisição inválida não chega ao banco. Os documentos são
+    serializados e enviados um lote por vez, então a memória usada não depende
+    do tamanho do resultado.
+    """
+    fmt = request.args.get("stream")
+    if fmt not in STREAM_FORMATS:
+        return jsonify({error_key: f"Invalid stream format '{fmt}'"}), 400
+
+    try:
+        size = batch_size()
+    except ValueError as e:
+        return jsonify({error_key: str(e)}), 400
+
+    cursor = open_cursor(size)
+    dumps = current_app.json.dumps
+
+    def generate():
+        first = True
+        chunk = ["["] if fmt == "json" else []
+
+        for doc in cursor:
+            body = dumps(transform(doc))
+            if fmt == "ndjson":
+                chunk.append(body + "\n")
+            else:
+                chunk.append(body if first else "," + body)
+            first = False
+
+            if len(chunk) >= size:
+                yield "".join(chunk)
+                chunk = []
+
+        if fmt == "json":
+            chunk.append("]")
+        if chunk:
+            yield "".join(chunk)
+
+    return Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[fmt])
@@ -0,0 +1,64 @@
+import os
+import sys
+from decimal import Decimal
+
+import mongomock
+import mongomock.collection
+import pytest
+from bson import Decimal128
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import connections  # noqa: E402
+
+# Banco em memória no lugar do MongoDB; precisa ser trocado antes de importar
+# as rotas, que guardam as coleções em variáveis de módulo
+connections.client = mongomock.MongoClient()
+connections.db = connections.client["FinFusion"]
+
+
+def _inc_updater(doc, field_name, value):
+    # O MongoDB soma Decimal128 com $inc; o mongomock não
+    current = doc.get(field_name, 0)
+    if isinstance(value, Decimal128) or isinstance(current, Decimal128):
+        as_decimal = [
+            v.to_decimal() if isinstance(v, Decimal128) else Decimal(v)
+            for v in (current, value)
+        ]
+        doc[field_name] = Decimal128(sum(as_decimal))
+    else:
+        doc[field_name] = current + value
+
+
+mongomock.collection._updaters["$inc"] = _inc_updater
+
+
+class FakeSession:
+    """O mongomock não tem transações: a função roda direto, sem sessão."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def with_transaction(self, callback):
+        return callback(None)
+
+
+connections.client.start_session = FakeSession
+
+from main import app  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    for name in connections.db.list_collection_names():
+        connections.db.drop_collection(name)
+    return connections.db
+
+
+@pytest.fixture
+def client(db):
+    app.config["TESTING"] = True
+    return app.test_client()
@@ -0,0 +1,74 @@
+from bson import Decimal128, ObjectId
+
+SPECIES = {
+    "name": "Betta",
+    "picture": "",
+    "description": "",
+    "ecosystem": "",
+    "feeding": "",
+    "size": "",
+    "tank_size": "",
+    "velocity": "",
+    "origin": "",
+    "social_behavior": "",
+    "price": 10,
+}
+
+
+def test_missing_ids_are_not_found(client, db):
+    missing = str(ObjectId())
+    res = client.post(
+        "/prods/bulk",
+        json=[
+            {"op": "price", "id": missing, "price": 5},
+            {"op": "delete", "id": missing},
+        ],
+    )
+    assert res.status_code == 200
+    assert [r["status"] for r in res.json["results"]] == ["not_found", "not_found"]
+    assert res.json["errors"] == 2
+
+
+def test_upsert_keeps_fields_outside_the_item(client, db):
+    _id = db["species"].insert_one(
+        {**SPECIES, "price": Decimal128("10"), "quantity": 7, "image": "ref.png"}
+    ).inserted_id
+
+    res = client.post(
+        "/prods/bulk",
+        json=[{"op": "upsert", "id": str(_id), "doc": {**SPECIES, "price": 12}}],
+    )
+    assert res.json["results"][0]["status"] == "ok"
+
+    doc = db["species"].find_one({"_id": _id})
+    assert doc["quantity"] == 7
+    assert doc["image"] == "ref.png"
+    assert doc["price"] == Decimal128("12")
+
+
+def test_species_can_hold_only_an_image_ref(client, db):
+    _id = db["species"].insert_one({**SPECIES, "picture": "data:..."}).inserted_id
+    doc = {**SPECIES, "image": "a" * 64 + ".png"}
+    del doc["picture"]
+
+    res = client.post(
+        "/prods/bulk",
+        json=[
+            {"op": "insert", "doc": doc},
+            {"op": "upsert", "id": str(_id), "doc": doc},
+            {"op": "insert", "doc": {**doc, "image": "../etc/passwd"}},
+            {"op": "insert", "doc": {k: v for k, v in doc.items() if k != "image"}},
+        ],
+    )
+    assert [r["status"] for r in res.json["results"]] == ["ok", "ok", "error", "error"]
+
+    stored = db["species"].find_one({"_id": _id})
+    assert stored["image"] == doc["image"]
+    assert "picture" not in stored
+
+
+def test_invalid_chunk_size(client, db):
+    items = [{"op": "delete", "id": str(ObjectId())}]
+    assert client.post("/prods/bulk?chunk=0", json=items).status_code == 400
+    assert client.post("/prods/bulk?chunk=abc", json=items).status_code == 200
+
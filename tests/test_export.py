@@ -0,0 +1,45 @@
+import json
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import sales.views
+
+
+def ids(res):
+    return [json.loads(line)["_id"] for line in res.get_data(as_text=True).splitlines()]
+
+
+def insert(date):
+    return str(sales.views.COLLECTION.insert_one({"date": date}).inserted_id)
+
+
+def test_export_since_last_picks_up_late_orders(client):
+    now = datetime(2026, 1, 1, 12)
+    first = insert(now)
+    second = insert(now + timedelta(seconds=10))
+
+    res = client.get("/sales/export?consumer=bi")
+    assert ids(res) == [first, second]
+
+    # Gravado depois do export, mas com data anterior à marca d'água
+    late = insert(now + timedelta(seconds=5))
+    res = client.get("/sales/export?consumer=bi&since=last")
+    assert ids(res) == [late]
+
+    res = client.get("/sales/export?consumer=bi&since=last")
+    assert ids(res) == []
+
+
+def test_export_resumes_after_id(client):
+    now = datetime(2026, 1, 1, 12)
+    first = insert(now)
+    second = insert(now)
+    third = insert(now + timedelta(seconds=1))
+    first, second = sorted([first, second])
+
+    res = client.get(f"/sales/export?after={first}")
+    assert ids(res) == [second, third]
+
+    res = client.get(f"/sales/export?after={ObjectId()}")
+    assert res.status_code == 400
@@ -0,0 +1,39 @@
+import os
+from io import BytesIO
+
+import pytest
+from bson import ObjectId
+from PIL import Image
+
+from products import images
+
+
+@pytest.fixture
+def image_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(images, "IMAGE_ROOT", str(tmp_path))
+    return tmp_path
+
+
+def png(size=(8, 8)) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def stored_files(root):
+    return [name for _, _, files in os.walk(root) for name in files]
+
+
+def test_decompression_bomb_is_400(client, image_root, monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 10)
+    res = client.post("/prods/images", data={"file": (BytesIO(png()), "a.png")})
+    assert res.status_code == 400
+    assert stored_files(image_root) == []
+
+
+def test_unknown_species_leaves_no_file(client, image_root):
+    res = client.post(
+        f"/prods/{ObjectId()}/image", data={"file": (BytesIO(png()), "a.png")}
+    )
+    assert res.status_code == 404
+    assert stored_files(image_root) == []
@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta
+
+from jobs import runner
+
+
+def test_lost_jobs_are_reported_as_failed(client, db):
+    old = datetime.now() - timedelta(seconds=runner.JOB_TIMEOUT + 60)
+    lost = runner.JOBS.insert_one(
+        {"kind": "test", "status": "running", "created_at": old, "started_at": old}
+    ).inserted_id
+    recent = runner.JOBS.insert_one(
+        {"kind": "test", "status": "queued", "created_at": datetime.now()}
+    ).inserted_id
+
+    res = client.get(f"/jobs/{lost}")
+    assert res.json["status"] == "failed"
+    assert res.json["error"]
+
+    assert client.get(f"/jobs/{recent}").json["status"] == "queued"
@@ -0,0 +1,41 @@
+import base64
+import json
+
+import pytest
+
+from products.pagination import decode_cursor, encode_cursor
+
+
+def make_token(payload) -> str:
+    raw = json.dumps(payload).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def test_round_trip():
+    doc = {"_id": "65f000000000000000000001", "name": "Betta"}
+    field, direction, value, _ = decode_cursor(encode_cursor("name", 1, doc))
+    assert (field, direction, value) == ("name", 1, "Betta")
+
+
+@pytest.mark.parametrize(
+    "value", ["not-a-number", {"$gt": 0}, [1, 2], None, 1.5]
+)
+def test_malformed_price_cursor(value):
+    token = make_token(["price", 1, value, "65f000000000000000000001"])
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(token)
+
+
+def test_malformed_price_cursor_is_400(client):
+    token = make_token(["price", 1, "NaN?", "65f000000000000000000001"])
+    res = client.get(f"/prods/filtros?ordem=crescente&cursor={token}")
+    assert res.status_code == 400
+    assert res.json == {"error": "Invalid cursor"}
+
+
+@pytest.mark.parametrize("args", ["page=abc", "page=0", "page=1&count=-5", "count=x"])
+def test_invalid_search_page_is_400(client, args):
+    res = client.get(f"/prods/busca/betta?{args}")
+    assert res.status_code == 400
+    assert "error" in res.json
+
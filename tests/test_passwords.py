@@ -0,0 +1,58 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import auth.passwords
+import auth.views
+
+
+class StuckPool:
+    """Pool cujo trabalho nunca termina, como com todos os núcleos ocupados."""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        future = Future()
+        future.set_running_or_notify_cancel()  # já rodando: não dá para cancelar
+        return future
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = StuckPool()
+    monkeypatch.setattr(auth.passwords, "_pool", lambda: pool)
+    monkeypatch.setattr(auth.passwords, "_slots", threading.BoundedSemaphore(1))
+    auth.views.collection.insert_one({"email": "ana@example.com", "password": b"x"})
+    return pool
+
+
+def login(client):
+    return client.post(
+        "/auth/login", json={"email": "ana@example.com", "password": "secret"}
+    )
+
+
+def test_login_gives_up_with_503_when_hashing_is_slow(client, pool, monkeypatch):
+    monkeypatch.setattr(auth.passwords, "HASH_TIMEOUT", 0.01)
+
+    res = login(client)
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"
+    assert "message" in res.json
+
+
+def test_saturated_pool_rejects_without_waiting(client, pool, monkeypatch):
+    monkeypatch.setattr(auth.passwords, "HASH_TIMEOUT", 0.01)
+    assert login(client).status_code == 503
+
+    # O hash anterior continua no processo e segura a única vaga
+    monkeypatch.setattr(auth.passwords, "HASH_TIMEOUT", 60)
+    started = time.monotonic()
+    res = login(client)
+    assert res.status_code == 503
+    assert time.monotonic() - started < 1
+    assert pool.submitted == 1
@@ -0,0 +1,17 @@
+import auth.views
+from ratelimit import TokenBucket
+
+
+def test_forwarded_clients_get_separate_buckets(client, monkeypatch):
+    monkeypatch.setattr(auth.views, "ip_limiter", TokenBucket(0.001, 1))
+
+    def login(ip):
+        return client.post(
+            "/auth/login",
+            json={"email": f"{ip}@example.com", "password": "secret"},
+            headers={"X-Forwarded-For": ip},
+        ).status_code
+
+    assert login("203.0.113.1") == 404
+    assert login("203.0.113.1") == 429
+    assert login("203.0.113.2") == 404
@@ -0,0 +1,21 @@
+import jwt
+from bson import Decimal128
+
+from main import app
+from tests.test_stock import order
+
+
+def test_logged_in_order_keeps_the_surname(client, db):
+    user = {"name": "Ana", "surname": "Silva", "email": "ana@example.com"}
+    user_id = db["users"].insert_one(user).inserted_id
+    token = jwt.encode({"sub": str(user_id)}, app.config["SECRET_KEY"])
+    species = {"name": "Betta", "price": Decimal128("10")}
+    species_id = db["species"].insert_one(species).inserted_id
+
+    res = client.post(
+        "/sales/new", json=order((species_id, 1)), headers={"Authorization": token}
+    )
+    assert res.status_code == 200, res.json
+
+    customer = db["orders"].find_one()["customer"]
+    assert customer == {**user, "_id": user_id}
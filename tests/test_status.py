@@ -0,0 +1,49 @@
+import jwt
+import pytest
+from bson import Decimal128, ObjectId
+
+from main import app
+from tests.test_stock import order
+
+
+def token_for(db, role):
+    user = {"name": "Bia", "email": "bia@example.com", "role": role}
+    user_id = db["users"].insert_one(user).inserted_id
+    token = jwt.encode({"sub": str(user_id)}, app.config["SECRET_KEY"])
+    return {"Authorization": token}
+
+
+@pytest.fixture
+def sale(client, db):
+    species = {"name": "Betta", "price": Decimal128("10")}
+    _id = db["species"].insert_one(species).inserted_id
+    res = client.post("/sales/new", json={**order((_id, 2)), "status": 1})
+    return res.json["inserted_id"], _id
+
+
+def test_status_change_requires_staff(client, db, sale):
+    order_id, _ = sale
+    url = f"/sales/{order_id}/status"
+    assert client.patch(url, json={"status": 2}).status_code == 400
+    res = client.patch(url, json={"status": 2}, headers=token_for(db, "cpf"))
+    assert res.status_code == 403
+
+
+@pytest.mark.parametrize(
+    "id, body",
+    [("zzz", {"status": 2}), (str(ObjectId()), [2]), (str(ObjectId()), {"status": 9})],
+)
+def test_status_change_rejects_bad_input(client, db, id, body):
+    headers = token_for(db, "staff")
+    res = client.patch(f"/sales/{id}/status", json=body, headers=headers)
+    assert res.status_code == 400
+
+
+def test_cancel_adjusts_counters(client, db, sale):
+    order_id, species_id = sale
+    assert db["species_sold"].find_one({"_id": species_id})["sold"] == 2
+
+    headers = token_for(db, "admin")
+    res = client.patch(f"/sales/{order_id}/status", json={"status": 2}, headers=headers)
+    assert res.status_code == 200
+    assert db["species_sold"].find_one({"_id": species_id})["sold"] == 0
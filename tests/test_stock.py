@@ -0,0 +1,59 @@
+import pytest
+from bson import Decimal128
+
+from sales.validation import price_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_prices():
+    price_cache.clear()
+
+
+def order(*items):
+    return {
+        "items": [{"id": str(_id), "qty": qty} for _id, qty in items],
+        "tax": "0",
+        "shipping": "10",
+        "shipping_provider": "Correios",
+        "payment_method": "pix",
+        "status": 0,
+        "customer": {
+            "name": "Ana",
+            "surname": "Silva",
+            "addr": "Rua A",
+            "cep": "00000-000",
+            "email": "ana@example.com",
+        },
+    }
+
+
+def test_species_without_quantity_is_unmanaged_stock(client, db):
+    species = db["species"]
+    _id = species.insert_one({"name": "Betta", "price": Decimal128("10")}).inserted_id
+
+    res = client.post("/sales/new", json=order((_id, 3)))
+
+    assert res.status_code == 200, res.json
+    assert "quantity" not in species.find_one({"_id": _id})
+
+
+def test_managed_stock_is_reserved(client, db):
+    species = db["species"]
+    _id = species.insert_one(
+        {"name": "Betta", "price": Decimal128("10"), "quantity": 5}
+    ).inserted_id
+
+    assert client.post("/sales/new", json=order((_id, 3))).status_code == 200
+    assert species.find_one({"_id": _id})["quantity"] == 2
+
+
+def test_reservation_refreshes_cached_catalog(client, db):
+    species = db["species"]
+    _id = species.insert_one(
+        {"name": "Betta", "price": Decimal128("10"), "quantity": 5}
+    ).inserted_id
+    assert client.get(f"/prods/{_id}").json["quantity"] == 5
+
+    assert client.post("/sales/new", json=order((_id, 3))).status_code == 200
+    assert client.get(f"/prods/{_id}").json["quantity"] == 2
+
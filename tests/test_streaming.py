@@ -0,0 +1,35 @@
+import pytest
+
+import sales.views
+
+
+@pytest.fixture
+def no_queries(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("query should not run")
+
+    monkeypatch.setattr(sales.views.COLLECTION, "aggregate", fail)
+    monkeypatch.setattr(sales.views.COLLECTION, "find", fail)
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/sales/?stream=xml",
+        "/sales/?stream=ndjson&batch_size=0",
+        "/sales/?stream=json&batch_size=abc",
+        "/sales/?fields=password",
+        "/sales/export?format=xml",
+        "/sales/export?batch_size=-1",
+    ],
+)
+def test_sales_validate_before_querying(client, no_queries, url):
+    res = client.get(url)
+    assert res.status_code == 400
+    assert list(res.json) == ["message"]
+
+
+def test_products_stream_errors_keep_error_key(client):
+    res = client.get("/prods/?stream=xml")
+    assert res.status_code == 400
+    assert "error" in res.json
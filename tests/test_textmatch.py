@@ -0,0 +1,26 @@
+import pytest
+
+import user.views
+
+
+def test_filter_users_matches_prefix_by_default(client):
+    user.views.COLLECTION.insert_many(
+        [
+            {"name": "Ana", "email": "a@example.com"},
+            {"name": "Joana", "email": "j@example.com"},
+        ]
+    )
+
+    res = client.get("/users/filter?name=An")
+    assert [u["name"] for u in res.json["match"]] == ["Ana"]
+
+    res = client.get("/users/filter?name=an&match=contains")
+    assert sorted(u["name"] for u in res.json["match"]) == ["Ana", "Joana"]
+
+
+@pytest.mark.parametrize("url", ["/users/filter", "/sales/filter"])
+def test_invalid_match_mode_is_400(client, url):
+    res = client.get(f"{url}?match=fuzzy")
+    assert res.status_code == 400
+    assert "match" in res.json["message"]
+
@@ -0,0 +1,48 @@
+import jwt
+import pytest
+
+import auth.views
+from cache import InvalidationChannel
+from main import app
+
+CARD_FIELDS = ["serial_cc", "expiration_cc", "backserial_cc"]
+
+
+@pytest.fixture
+def user(db):
+    auth.views.user_cache.clear()
+    user_id = auth.views.collection.insert_one(
+        {
+            "name": "Ana",
+            "email": "ana@example.com",
+            "role": "cpf",
+            "password": "hash",
+            "serial_cc": "4111111111111111",
+            "expiration_cc": "12/30",
+            "backserial_cc": "123",
+        }
+    ).inserted_id
+    token = jwt.encode({"sub": str(user_id)}, app.config["SECRET_KEY"])
+    return user_id, {"Authorization": token}
+
+
+@pytest.mark.parametrize("url", ["/auth/check", "/users/me"])
+def test_card_fields_are_never_returned(client, user, url):
+    _, headers = user
+    res = client.get(url, headers=headers)
+    assert res.status_code == 200
+    assert res.json["name"] == "Ana"
+    for field in CARD_FIELDS + ["password"]:
+        assert field not in res.json
+
+
+def test_user_cache_follows_writes_from_other_workers(client, user, monkeypatch):
+    user_id, headers = user
+    monkeypatch.setattr(auth.views.user_cache.channel, "interval", 0)
+    assert client.get("/users/me", headers=headers).json["name"] == "Ana"
+
+    # Outro worker altera o usuário e avisa pelo canal
+    auth.views.collection.update_one({"_id": user_id}, {"$set": {"name": "Bia"}})
+    InvalidationChannel(auth.views.user_cache.channel.collection, "users").publish()
+
+    assert client.get("/users/me", headers=headers).json["name"] == "Bia"
@@ -0,0 +1,30 @@
+import pytest
+
+import auth.views
+
+
+@pytest.fixture
+def user_id(db):
+    auth.views.user_cache.clear()
+    user = {"name": "Ana", "email": "ana@example.com", "role": "cpf", "version": 1}
+    return str(db["users"].insert_one(user).inserted_id)
+
+
+@pytest.mark.parametrize(
+    "body",
+    [{"nickname": "Aninha"}, {"name": 123}, {"serial_cc": "4111111111111111"}],
+)
+def test_update_rejects_unknown_fields_and_types(client, db, user_id, body):
+    res = client.put(f"/users/{user_id}", json=body)
+    assert res.status_code == 400
+    assert db["users"].find_one()["version"] == 1
+
+
+def test_unchanged_values_are_not_written(client, db, user_id):
+    res = client.put(f"/users/{user_id}", json={"name": "Ana", "role": "cpf"})
+    assert res.status_code == 200
+    assert res.json["version"] == 1
+
+    res = client.put(f"/users/{user_id}", json={"name": "Bia", "role": "cpf"})
+    assert res.json["version"] == 2
+    assert db["users"].find_one()["name"] == "Bia"
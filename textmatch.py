@@ -0,0 +1,41 @@
+import re
+from typing import Any, Mapping
+
+from pymongo.collation import Collation, CollationStrength
+
+# Comparação que ignora maiúsculas/minúsculas. O índice só é usado quando a
+# consulta pede exatamente a mesma collation com que ele foi criado.
+CASE_INSENSITIVE = Collation(locale="en", strength=CollationStrength.SECONDARY)
+
+MATCH_MODES = ("exact", "prefix", "contains")
+# prefix e exact usam os índices; contains aceita qualquer posição, mas
+# percorre o índice inteiro, e por isso só roda quando pedido
+DEFAULT_MATCH = "prefix"
+
+# Na collation do ICU, U+FFFF vem depois de qualquer outro caractere
+_MAX_CHAR = "\uffff"
+
+
+def match_mode(args: Mapping[str, str]) -> str:
+    """Modo pedido em `match` nas rotas de filtro. Lança ValueError se inválido."""
+    mode = args.get("match", DEFAULT_MATCH)
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Invalid match mode '{mode}', expected one of: {MATCH_MODES}")
+    return mode
+
+
+def text_filter(value: str, mode: str = DEFAULT_MATCH) -> dict[str, Any]:
+    """Filtro de texto para consultas feitas com CASE_INSENSITIVE.
+
+    `exact` e `prefix` (padrão) viram igualdade e intervalo
+    `[value, value + U+FFFF)`, que usam o índice; `contains`, só quando pedido,
+    busca o trecho em qualquer posição com uma regex, e por isso percorre o
+    índice ou a coleção inteira.
+    """
+    if mode == "exact":
+        return {"$eq": value}
+    if mode == "prefix":
+        return {"$gte": value, "$lt": value + _MAX_CHAR}
+    if mode == "contains":
+        return {"$regex": re.escape(value), "$options": "i"}
+    raise ValueError(f"Invalid match mode '{mode}', expected one of: {MATCH_MODES}")
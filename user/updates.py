@@ -0,0 +1,114 @@
+from typing import Any, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from connections import db
+
+USERS = db["users"]
+
+# Campos que nenhuma rota de atualização pode alterar
+LOCKED_FIELDS = {"_id", "email", "password", "version"}
+# O próprio usuário também não troca o nome pelo /me
+PROFILE_LOCKED_FIELDS = LOCKED_FIELDS | {"name"}
+ROLES = ["cpf", "cnpj", "staff"]
+
+# Campos que as rotas de atualização aceitam e o tipo de cada um.
+# Senha e dados de cartão nunca são alterados por aqui.
+UPDATABLE_FIELDS = {
+    "name": str,
+    "surname": str,
+    "role": str,
+    "addr": str,
+    "city": str,
+    "state": str,
+    "uf": str,
+    "tel": str,
+    "picture": str,
+    "cpf": str,
+    "cnpj": str,
+}
+# Tentativas quando outra escrita muda o usuário entre a leitura e a gravação
+UPDATE_RETRIES = 3
+
+
+class VersionConflictError(Exception):
+    pass
+
+
+def validate_changes(
+    body: Any, locked: set[str]
+) -> tuple[dict[str, Any], Optional[int]]:
+    """Separa o corpo da requisição em campos a gravar e versão esperada.
+
+    A versão é opcional; sem ela, a última escrita prevalece.
+    Lança ValueError se o corpo for inválido.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("Expected a JSON object")
+
+    changes = dict(body)
+    version = changes.pop("version", None)
+    if version is not None and type(version) is not int:
+        raise ValueError("Invalid 'version' value")
+
+    blocked = sorted(k for k in changes if k in locked)
+    if blocked:
+        raise ValueError(f"Trying to update locked fields: {', '.join(blocked)}")
+
+    unknown = sorted(k for k in changes if k not in UPDATABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"Invalid fields: {', '.join(unknown)}")
+
+    mistyped = sorted(
+        k for k, v in changes.items() if not isinstance(v, UPDATABLE_FIELDS[k])
+    )
+    if mistyped:
+        raise ValueError(f"Invalid values for: {', '.join(mistyped)}")
+
+    if "role" in changes and changes["role"] not in ROLES:
+        raise ValueError("Invalid role")
+
+    if not changes:
+        raise ValueError("Nothing to update")
+
+    return changes, version
+
+
+def apply_changes(
+    user_id: ObjectId, changes: dict[str, Any], version: Optional[int] = None
+) -> Optional[tuple[int, dict[str, Any]]]:
+    """Grava só os campos cujo valor mudou e incrementa `version`.
+
+    Retorna a versão resultante e os campos gravados (vazio se nada mudou, e
+    então a versão não avança), ou None se o usuário não existir.
+    Lança VersionConflictError se `version` não for a versão atual.
+    """
+    projection = {**{k: 1 for k in changes}, "version": 1}
+    for _ in range(UPDATE_RETRIES):
+        current = USERS.find_one({"_id": user_id}, projection)
+        if current is None:
+            return None
+
+        # Usuários anteriores ao controle de versão não têm o campo
+        current_version = current.get("version")
+        if version is not None and version != (current_version or 0):
+            raise VersionConflictError("User was modified by another request")
+
+        diff = {k: v for k, v in changes.items() if current.get(k) != v}
+        if not diff:
+            return current_version or 0, diff
+
+        # Só grava se ninguém alterou o usuário desde a leitura
+        user = USERS.find_one_and_update(
+            {"_id": user_id, "version": current_version},
+            {"$set": diff, "$inc": {"version": 1}},
+            projection={"version": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if user is not None:
+            return user["version"], diff
+        if version is not None:
+            raise VersionConflictError("User was modified by another request")
+
+    raise VersionConflictError("User was modified by another request")
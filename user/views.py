@@ -1,12 +1,23 @@
 from collections import defaultdict
 from math import ceil
 from typing import Any
-from bson import ObjectId, Regex
+from bson import ObjectId
 from flask import Blueprint, jsonify, request
 import pymongo
 
-from auth.views import login_required
+from auth.views import current_identity, invalidate_user, login_required
 from connections import db
+from projection import parse_fields
+from sales.snapshots import refresh_customer_snapshots
+from streaming import stream_response
+from textmatch import CASE_INSENSITIVE, match_mode, text_filter
+from user.updates import (
+    LOCKED_FIELDS,
+    PROFILE_LOCKED_FIELDS,
+    VersionConflictError,
+    apply_changes,
+    validate_changes,
+)
 
 COLLECTION = db["users"]
 users = Blueprint("users", __name__)
@@ -15,21 +26,84 @@ users = Blueprint("users", __name__)
 # { is_company, name, email, phone, rg*1, cpf*1, cnpj*2, serial_CC, expiration_CC, backserial_CC, zip_code?, address? }
 
 
+# Senha e dados de cartão nunca entram na lista de campos permitidos
+USER_FIELDS = {
+    "name",
+    "email",
+    "role",
+    "addr",
+    "city",
+    "state",
+    "uf",
+    "tel",
+    "picture",
+    "cpf",
+    "cnpj",
+    "version",
+}
+LIST_FIELDS = ["name", "email", "role", "tel", "city", "state", "picture"]
+# Campos de texto filtrados pelo /filter, com índice em CASE_INSENSITIVE
+TEXT_FIELDS = ["name", "email", "tel"]
+
+
 def to_dict(item) -> dict[str, Any]:
     item["_id"] = str(item["_id"])
-    item["password"] = item["password"].decode()
+    item.pop("password", None)
     return item
 
 
+def list_projection():
+    return parse_fields(request.args.get("fields"), USER_FIELDS, LIST_FIELDS)
+
+
+def save_changes(user_id: ObjectId, locked: set[str], message: str, key: str):
+    """Caminho comum de PUT /users/<id> e PUT /users/me.
+
+    Envie `version` no corpo para só gravar se ninguém alterou o usuário desde
+    a leitura (409 caso contrário).
+    """
+    try:
+        changes, version = validate_changes(request.get_json(silent=True), locked)
+        applied = apply_changes(user_id, changes, version)
+    except ValueError as e:
+        return jsonify({key: str(e)}), 400
+    except VersionConflictError as e:
+        return jsonify({key: str(e)}), 409
+
+    if applied is None:
+        return jsonify({key: "User not found"}), 404
+
+    new_version, changed = applied
+    if changed:
+        invalidate_user(user_id)
+        refresh_customer_snapshots(user_id, changed)
+    return jsonify({"message": message, "version": new_version}), 200
+
+
 @users.get("/")
 def get_users():
-    users = list(COLLECTION.find())
+    try:
+        projection = list_projection()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if "stream" in request.args:
+        return stream_response(
+            lambda size: COLLECTION.find({}, projection).batch_size(size), to_dict
+        )
+
+    users = list(COLLECTION.find({}, projection))
     return jsonify([to_dict(e) for e in users]), 200
 
 
 @users.get("/role/<role>")
 def get_users_by_role(role):
-    users = list(COLLECTION.find({"role": role}))
+    try:
+        projection = list_projection()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    users = list(COLLECTION.find({"role": role}, projection))
     return jsonify([to_dict(e) for e in users]), 200
 
 
@@ -40,14 +114,13 @@ def filter_users():
     filters = defaultdict(dict)
     ordering = {}
 
-    if "name" in body:
-        filters["name"] = {"$regex": Regex(body["name"], "i")}
-
-    if "email" in body:
-        filters["email"] = {"$regex": Regex(body["email"])}
-
-    if "tel" in body:
-        filters["tel"] = {"$regex": Regex(rf"\b{body['tel']}\d*")}
+    try:
+        match = match_mode(body)
+        for field in TEXT_FIELDS:
+            if field in body:
+                filters[field] = text_filter(body[field], match)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
 
     if "role" in body:
         filters["role"] = "role"
@@ -66,12 +139,20 @@ def filter_users():
     if not ordering:
         ordering["_id"] = pymongo.ASCENDING
 
+    try:
+        projection = list_projection()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
     count = int(body.get("count", 20))
     page = int(body.get("page", 1))
     pagination = [{"$skip": count * (page - 1)}, {"$limit": count}]
 
     query = COLLECTION.aggregate(
-        [{"$match": filters}, {"$sort": ordering}] + pagination
+        [{"$match": filters}, {"$sort": ordering}]
+        + pagination
+        + [{"$project": projection}],
+        collation=CASE_INSENSITIVE,
     )
 
     full_count_result = COLLECTION.aggregate(
@@ -79,7 +160,8 @@ def filter_users():
             {"$match": filters},
             {"$sort": ordering},
             {"$group": {"_id": None, "count": {"$sum": 1}}},
-        ]
+        ],
+        collation=CASE_INSENSITIVE,
     )
 
     full_count = 0
@@ -102,35 +184,14 @@ def get_user_by_id(id):
 
 @users.put("/<id>")
 def update_user(id):
-    final_user = COLLECTION.find_one({"_id": ObjectId(id)})
-
-    if final_user is None:
-        return jsonify({"error": "User not found"}), 404
-
-    for key, value in request.json.items():
-        if key not in ["_id", "email", "password"]:
-            if key == "role" and value not in ["cpf", "cnpj", "staff"]:
-                return jsonify({"error": "Invalid role"}), 400
-
-            final_user[key] = value
-        else:
-            return (
-                jsonify(
-                    {"error": "Trying to update locked fields: id, email or password"}
-                ),
-                400,
-            )
-
-    result = COLLECTION.update_one({"_id": ObjectId(id)}, {"$set": final_user})
-    if result.matched_count:
-        return jsonify({"message": "User updated"}), 200
-    return jsonify({"error": "User not found"}), 404
+    return save_changes(ObjectId(id), LOCKED_FIELDS, "User updated", key="error")
 
 
 @users.delete("/<id>")
 def delete_user(id):
     result = COLLECTION.delete_one({"_id": ObjectId(id)})
     if result.deleted_count:
+        invalidate_user(id)
         return jsonify({"message": "User deleted"}), 200
     return jsonify({"error": "User not found"}), 404
 
@@ -139,9 +200,8 @@ def delete_user(id):
 @login_required
 def get_user_profile(payload):
     try:
-        user = COLLECTION.find_one({"email": payload["email"]})
-        user = to_dict(user)
-        user.pop("password")
+        # Já carregado (e em cache) pelo login_required
+        user = to_dict(dict(current_identity().user))
         return jsonify(user), 200
     except Exception as e:
         print(e.args)
@@ -151,17 +211,20 @@ def get_user_profile(payload):
 @users.put("/me")
 @login_required
 def update_user_profile(payload):
-    body = dict(request.get_json())
-
-    blocked_fields = ["email", "name", "_id", "password"]
-    filtered = [f for f in blocked_fields if body.get(f, None)]
-    if filtered:
-        return jsonify(
-            {"message": f"Tried to edit blocked fields: {', '.join(filtered)}"}
-        )
+    return save_changes(
+        ObjectId(payload["sub"]),
+        PROFILE_LOCKED_FIELDS,
+        "Object saved successfully",
+        key="message",
+    )
 
-    res = COLLECTION.update_one({"_id": ObjectId(payload["sub"])}, {"$set": body})
-    if not res.acknowledged:
-        return jsonify({"message": "Database failed to write data"}), 500
 
-    return jsonify({"message": "Object saved successfully"}), 200
+@users.cli.command("create-indexes")
+def create_indexes():
+    """Cria os índices sem diferenciar maiúsculas/minúsculas usados pelo /filter."""
+    for field in TEXT_FIELDS:
+        print(
+            COLLECTION.create_index(
+                field, name=f"{field}_ci", collation=CASE_INSENSITIVE
+            )
+        )